@@ -1,106 +1,187 @@
 import threading
-import socket
-import zlib
-import pickle
-import sys
-import time
+from concurrent.futures import Future
+
+import uiEvents
 from comunicationCodes import ComCodes
+from connectionManager import PeerConnection
 
 
-class ServerConnection(threading.Thread):
+class ServerConnection(PeerConnection):
 
     def __init__(self, host, sendPort, listenPort):
-        super().__init__()
-
-        self.__host = host
-        self.__sendPort = sendPort
-        self.__listenPort = listenPort
-        self.__listenConnection = socket.socket()
-        self.__sendConnection = socket.socket()
-        self.__bufferSize = 1024
+        super().__init__('server', host, sendPort, listenPort)
 
         self.__preAccuracy = None
         self.__postAccuracy = None
 
-    def setCallbacks(self, imageIsSet, enablePredictBtn):
-        self.enablePredictBtn = enablePredictBtn
-        self.imageIsSet = imageIsSet
-
-    def addQtControls(self, preLabel, postLabel, trainBtn, netBtn, modelUpdateBtns, downloadBtn, downloadedModelLabel, downloadedModelAccuracy):
-        self.netBtn = netBtn
-        self.trainBtn = trainBtn
-        self.preLabel = preLabel
-        self.postLabel = postLabel
-        self.downloadedModelLabel = downloadedModelLabel
-        self.downloadedModelAccuracyLabel = downloadedModelAccuracy
-        self.modelUpdateBtns = modelUpdateBtns
-        self.downloadBtn = downloadBtn
+        # (server weights version, local model weights version) of the last applied download
+        self.__weightsVersion = None
+        self.__topK = None
+        self.__worker = None
 
     def addModelRef(self, model):
         self.model = model
 
+    def setWorker(self, worker):
+        """@setWorker
+
+        @:param worker ModelWorker: runs model updates; without one they run on the connection thread.
+        """
+        self.__worker = worker
+
+    def __runModelJob(self, fn, *args, onDone=None):
+        """@__runModelJob
+
+        :return: Future of fn(*args), run on the model worker if one is set. onDone (future) is called once
+            it is done, on the GUI thread when a worker delivers it.
+        """
+        if self.__worker is not None:
+            return self.__worker.submit(fn, *args, onDone=onDone)
+        job = Future()
+        try:
+            job.set_result(fn(*args))
+        except Exception as e:
+            job.set_exception(e)
+        if onDone is not None:
+            onDone(job)
+        return job
+
+    def setUpdateTopK(self, topK):
+        self.__topK = topK
+
+    def __hasWeightsBase(self):
+        return self.__weightsVersion is not None and self.__weightsVersion[1] == self.model.getWeightsVersion()
+
+    def __weightsRequest(self, full):
+        base = None
+        if not full and self.__hasWeightsBase():
+            base = self.__weightsVersion[0]
+        return self.request(ComCodes.GET_WEIGHTS, {'base': base, 'topK': self.__topK})
+
+    def requestWeights(self, full=False):
+        """@requestWeights
+
+        Asks the server for trainable weights. Unless full is set, the server is told which version the local
+        model holds so it can answer with a delta against it.
+
+        :return: Future resolved with the GET_WEIGHTS reply once the weights are applied to the model
+            (on the model worker if one is set).
+        """
+        weights = self.__weightsRequest(full)
+        return self.__then(weights, self.__setWeights)
+
+    def downloadModel(self):
+        """@downloadModel
+
+        Fetches the model from the server. When the local model still holds the last downloaded weights only
+        a weight update is requested; otherwise structure and weights are requested together in one
+        pipelined exchange and applied in that order.
+
+        :return: Future resolved once the model is updated.
+        """
+        if self.__hasWeightsBase():
+            return self.requestWeights()
+
+        structure = self.request(ComCodes.GET_STRUCTURE)
+        weights = self.__weightsRequest(full=True)
+        done = Future()
+        applied = []
+        mutex = threading.Lock()
+
+        def apply(_):
+            with mutex:
+                if applied or not (structure.done() and weights.done()):
+                    return
+                applied.append(True)
+            try:
+                # both jobs are queued on the model worker, which runs them in this order
+                self.__setStructure(structure.result()[1])
+                self.__chain(self.__setWeights(weights.result()), done)
+            except Exception as e:
+                print('Model download failed:', e)
+                done.set_exception(e)
+
+        structure.add_done_callback(apply)
+        weights.add_done_callback(apply)
+        return done
+
+    def __chain(self, source, target):
+        def callback(f):
+            if f.cancelled():
+                target.cancel()
+            elif f.exception() is not None:
+                target.set_exception(f.exception())
+            else:
+                target.set_result(f.result())
+
+        source.add_done_callback(callback)
+
+    def __then(self, future, handler):
+        """@__then
+
+        :return: Future of handler(reply) once future resolved; when handler returns a Future it is awaited too.
+        """
+        done = Future()
+
+        def callback(f):
+            try:
+                result = handler(f.result())
+            except Exception as e:
+                print('Request failed:', e)
+                done.set_exception(e)
+                return
+            if isinstance(result, Future):
+                self.__chain(result, done)
+            else:
+                done.set_result(result)
+
+        future.add_done_callback(callback)
+        return done
+
+    def __setStructure(self, netType):
+        def onDone(job):
+            if not job.cancelled() and job.exception() is None:
+                self.postEvent(uiEvents.MODEL_TYPE, value=self.model.getModelType())
+
+        return self.__runModelJob(self.model.setNet, netType, False, onDone=onDone)
+
+    def __applyWeights(self, response):
+        info = response[3] if len(response) > 3 else None
+        self.model.applyTrainableWeightsUpdate(response[1], info)
+        if info is not None:
+            self.__weightsVersion = (info['version'], self.model.getWeightsVersion())
+        return response
+
+    def __setWeights(self, response):
+        def onDone(job):
+            if job.cancelled() or job.exception() is not None:
+                return
+            self.postEvent(uiEvents.MODEL_ACCURACY, value=str(response[2])[:5])
+            self.postEvent(uiEvents.PREDICT_ENABLED, value=True)
+
+        return self.__runModelJob(self.__applyWeights, response, onDone=onDone)
+
     def setAccuracyText(self):
         self.enableButtons()
-        self.preLabel.setText(str(self.__preAccuracy)[:5])
-        self.postLabel.setText(str(self.__postAccuracy)[:5])
+        self.postEvent(uiEvents.SERVER_ACCURACY, value=(str(self.__preAccuracy)[:5], str(self.__postAccuracy)[:5]))
 
     def enableButtons(self):
-        for btn in self.modelUpdateBtns:
-            btn.setEnabled(True)
-        self.trainBtn.setEnabled(True)
-        self.netBtn.setEnabled(True)
-        self.downloadBtn.setEnabled(True)
-
-    def send(self, message):
-        print('sending', self.__sendPort, message)
-        resp = zlib.compress(pickle.dumps(message), 4)
-        size = sys.getsizeof(resp)
-
-        self.__sendConnection.sendall(pickle.dumps(size))
-        time.sleep(1)
-        self.__sendConnection.sendall(resp)
-
-    def __listenerThread(self):
-        while True:
-
-            try:
-                received_data = b''
-                size = pickle.loads(self.__listenConnection.recv(self.__bufferSize))
-                # print('Device', self.getName(),'receiving data of size', size)
-                while sys.getsizeof(received_data) < size:
-                    data = self.__listenConnection.recv(self.__bufferSize)
-                    received_data += data
-                    # progressBar(size, sys.getsizeof(received_data))
-                # progressBar(size, sys.getsizeof(received_data), True)
-                # self.__listenerMutex.acquire()
-                if received_data != b'':
-                    response = (pickle.loads(zlib.decompress(received_data)))
-                    if response[0] == ComCodes.POST_ACCURACY:
-                        self.__preAccuracy = response[1][0]
-                        self.__postAccuracy = response[1][1]
-                        self.setAccuracyText()
-                        self.enableButtons()
-                    elif response[0] == ComCodes.LOAD_MODEL and response[1] is True:
-                        pass
-                    elif response[0] == ComCodes.GET_STRUCTURE:
-                        self.model.setNet(response[1], False)
-                        self.send([ComCodes.GET_WEIGHTS])
-                        self.downloadedModelLabel.setText(self.model.getModelType())
-                    elif response[0] == ComCodes.GET_WEIGHTS:
-                        self.model.setTrainableWeights(response[1])
-                        self.downloadedModelAccuracyLabel.setText(str(response[2])[:5])
-                        if self.imageIsSet():
-                            self.enablePredictBtn()
-
-                # self.__listenerMutex.release()
-                # print('Device', self.getName(), 'received all data of size', size)
-            finally:
-                time.sleep(1)
-
-    def run(self):
-        print('Trying to connect on ports', self.__listenPort, self.__sendPort)
-        self.__listenConnection.connect((self.__host, self.__listenPort))
-        self.__sendConnection.connect((self.__host, self.__sendPort))
-
-        listener = threading.Thread(target=self.__listenerThread)
-        listener.start()
+        self.postEvent(uiEvents.CONTROLS_ENABLED, value=True)
+
+    def send(self, message, requestId=0):
+        print('sending', self.getSendPort(), message)
+        super().send(message, requestId)
+
+    def handleMessage(self, header, response):
+        if response[0] == ComCodes.POST_ACCURACY:
+            self.__preAccuracy = response[1][0]
+            self.__postAccuracy = response[1][1]
+            self.setAccuracyText()
+            self.enableButtons()
+        elif response[0] == ComCodes.LOAD_MODEL and response[1] is True:
+            self.__weightsVersion = None
+        elif response[0] == ComCodes.GET_STRUCTURE:
+            self.__setStructure(response[1])
+            self.requestWeights(full=True)
+        elif response[0] == ComCodes.GET_WEIGHTS:
+            self.__setWeights(response)
@@ -0,0 +1,191 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import tensorFormat
+
+
+class FedAvgAggregator:
+    """@FedAvgAggregator
+
+    Sample-weighted running average of client weights. Every update is folded into preallocated float32
+    buffers as it arrives, so memory stays at one model copy (plus scratch for the largest tensor) no
+    matter how many clients report.
+    """
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__mutex:
+            self.__mean = None
+            self.__scratch = None
+            self.__count = 0
+            self.__samples = 0.0
+
+    def getCount(self):
+        return self.__count
+
+    def getSamples(self):
+        return self.__samples
+
+    def __allocate(self, weights):
+        self.__mean = [np.zeros(w.shape, dtype=np.float32) for w in weights]
+        self.__scratch = np.empty(max(w.size for w in weights), dtype=np.float32)
+
+    def add(self, weights, samples=1.0):
+        """@add
+
+        @:param weights list: client weights (numpy arrays or quantized tensors).
+        @:param samples float: number of samples the client trained on, used as the update weight.
+        """
+        if samples <= 0:
+            return
+        weights = [tensorFormat.dequantize(w) for w in weights]
+        with self.__mutex:
+            if self.__mean is None:
+                self.__allocate(weights)
+            elif [m.shape for m in self.__mean] != [w.shape for w in weights]:
+                raise ValueError('Update shapes do not match shapes of the aggregated model')
+
+            self.__samples += samples
+            self.__count += 1
+            factor = samples / self.__samples
+            for mean, w in zip(self.__mean, weights):
+                # mean += (w - mean) * samples / total, without temporaries
+                step = self.__scratch[:mean.size].reshape(mean.shape)
+                np.subtract(w, mean, out=step, casting='unsafe')
+                step *= factor
+                mean += step
+
+    def result(self):
+        """@result
+
+        :return: list of averaged weights, None if nothing was added. Arrays are copies.
+        """
+        with self.__mutex:
+            if self.__mean is None:
+                return None
+            return [m.copy() for m in self.__mean]
+
+
+class FedProxAggregator(FedAvgAggregator):
+    """@FedProxAggregator
+
+    FedProx aggregates like FedAvg; the proximal term is applied by clients during local training.
+    getTrainingArgs returns the arguments to send with RETRAIN_MODEL.
+    """
+
+    def __init__(self, mu=0.01):
+        super().__init__()
+        self.mu = mu
+
+    def getTrainingArgs(self):
+        return {'mu': self.mu}
+
+
+class CoordinateAggregator:
+    """@CoordinateAggregator
+
+    Coordinate-wise median or trimmed mean of client weights. These need every update at once, so updates
+    are spilled row by row into a temporary file and reduced in column chunks from a memory map; resident
+    memory stays O(model + chunk). Sample counts are not used.
+
+    @:param method str: 'median' or 'trimmedMean'.
+    @:param trim float: fraction of the lowest and of the highest values dropped per coordinate by trimmedMean.
+    @:param chunkBytes int: size of the block of the memory map reduced at once.
+    """
+
+    def __init__(self, method='median', trim=0.1, chunkBytes=64 * 1024 * 1024, spillDir=None):
+        if method not in ('median', 'trimmedMean'):
+            raise ValueError('Unknown method ' + str(method) + ", expected 'median' or 'trimmedMean'")
+        if not 0 <= trim < 0.5:
+            raise ValueError('trim has to be in [0, 0.5)')
+        self.method = method
+        self.trim = trim
+        self.__chunkBytes = chunkBytes
+        self.__spillDir = spillDir
+        self.__mutex = threading.Lock()
+        self.__file = None
+        self.reset()
+
+    def reset(self):
+        with self.__mutex:
+            self.__close()
+            self.__shapes = None
+            self.__count = 0
+            self.__samples = 0.0
+
+    def __close(self):
+        if self.__file is not None:
+            name = self.__file.name
+            self.__file.close()
+            os.remove(name)
+            self.__file = None
+
+    def getCount(self):
+        return self.__count
+
+    def getSamples(self):
+        return self.__samples
+
+    def add(self, weights, samples=1.0):
+        weights = [tensorFormat.dequantize(w) for w in weights]
+        with self.__mutex:
+            if self.__shapes is None:
+                self.__shapes = [w.shape for w in weights]
+                self.__file = tempfile.NamedTemporaryFile(prefix='aggregation_', suffix='.f32',
+                                                          dir=self.__spillDir, delete=False)
+            elif self.__shapes != [w.shape for w in weights]:
+                raise ValueError('Update shapes do not match shapes of the aggregated model')
+            for w in weights:
+                self.__file.write(np.ascontiguousarray(w, dtype=np.float32).data)
+            self.__count += 1
+            self.__samples += samples
+
+    def __reduce(self, block):
+        if self.method == 'median':
+            return np.median(block, axis=0)
+        n = block.shape[0]
+        cut = int(n * self.trim)
+        block = np.sort(block, axis=0)
+        return block[cut:n - cut].mean(axis=0)
+
+    def result(self):
+        with self.__mutex:
+            if self.__shapes is None:
+                return None
+            self.__file.flush()
+            size = sum(int(np.prod(shape)) for shape in self.__shapes)
+            updates = np.memmap(self.__file.name, dtype=np.float32, mode='r', shape=(self.__count, size))
+            flat = np.empty(size, dtype=np.float32)
+            step = max(1, self.__chunkBytes // (4 * self.__count))
+            for start in range(0, size, step):
+                flat[start:start + step] = self.__reduce(updates[:, start:start + step])
+            del updates
+
+            result = []
+            offset = 0
+            for shape in self.__shapes:
+                n = int(np.prod(shape))
+                result.append(flat[offset:offset + n].reshape(shape))
+                offset += n
+            return result
+
+    def __del__(self):
+        self.__close()
+
+
+def createAggregator(method='fedavg', **kwargs):
+    """@createAggregator
+
+    @:param method str: 'fedavg', 'fedprox', 'median' or 'trimmedMean'.
+    """
+    if method == 'fedavg':
+        return FedAvgAggregator()
+    if method == 'fedprox':
+        return FedProxAggregator(**kwargs)
+    return CoordinateAggregator(method, **kwargs)
@@ -0,0 +1,59 @@
+import sys
+import time
+
+import payloadCodecs
+import tensorFormat
+
+
+def benchmarkPayload(buffers, repeats=3):
+    """@benchmarkPayload
+
+    @:param buffers list: encoded message body.
+    @:param repeats int: best of repeats is reported.
+    :return: list of (codec name, compression ratio, compress MB/s, decompress MB/s).
+    """
+    payload = b''.join(buffers)
+    size = len(payload)
+    results = []
+    for name in payloadCodecs.getCodecNames():
+        compressTime = float('inf')
+        decompressTime = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            compressed = payloadCodecs.compress(name, [payload])[0]
+            compressTime = min(compressTime, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            payloadCodecs.decompress(name, compressed)
+            decompressTime = min(decompressTime, time.perf_counter() - start)
+
+        mb = size / 1e6
+        results.append((name, size / len(compressed), mb / max(compressTime, 1e-9), mb / max(decompressTime, 1e-9)))
+    return results
+
+
+def printResults(title, size, results):
+    print(title + ', ' + str(round(size / 1e6, 2)) + ' MB')
+    print('{:<14}{:>10}{:>16}{:>18}'.format('codec', 'ratio', 'compress MB/s', 'decompress MB/s'))
+    for name, ratio, compressSpeed, decompressSpeed in results:
+        print('{:<14}{:>10.3f}{:>16.1f}{:>18.1f}'.format(name, ratio, compressSpeed, decompressSpeed))
+    print()
+
+
+def benchmarkNet(netType, repeats=3):
+    from convNet1 import convModel
+
+    model = convModel()
+    model.setNet(netType, False)
+    payloads = [('all weights', model.getWeights()), ('trainable weights', model.getTrainableWeights())]
+
+    for title, weights in payloads:
+        for mode in tensorFormat.TRANSFER_MODES:
+            buffers, size = tensorFormat.encode([weights], mode)
+            printResults(netType + ' ' + title + ' (' + mode + ')', size, benchmarkPayload(buffers, repeats))
+
+
+if __name__ == '__main__':
+    nets = sys.argv[1:] if len(sys.argv) > 1 else ['vgg']
+    for net in nets:
+        benchmarkNet(net)
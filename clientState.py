@@ -0,0 +1,84 @@
+import numpy as np
+
+UNKNOWN = -1
+REFUSED = 0
+ACCEPTED = 1
+
+
+class ClientStateStore:
+    """@ClientStateStore
+
+    State of every client shown by the controller, kept in one numpy array per column instead of objects
+    or widgets per client. Changed rows are remembered until takeDirty, so views refresh only those.
+
+    @:param names list: client names, in row order.
+    @:param endpoints list: connection details of the clients.
+    """
+
+    def __init__(self, names, endpoints):
+        self.names = list(names)
+        self.endpoints = list(endpoints)
+        self.__rows = {name: row for row, name in enumerate(self.names)}
+        n = len(self.names)
+        self.participation = np.full(n, UNKNOWN, dtype=np.int8)
+        self.accuracy = np.full(n, np.nan, dtype=np.float32)
+        self.latency = np.full(n, np.nan, dtype=np.float32)
+        self.bytesSent = np.zeros(n, dtype=np.int64)
+        self.bytesReceived = np.zeros(n, dtype=np.int64)
+        self.__dirty = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.names)
+
+    def getRow(self, name):
+        return self.__rows[name]
+
+    def setParticipation(self, name, value):
+        """@setParticipation
+
+        @:param value: answer of the server, True, False or '-' when unknown.
+        """
+        row = self.__rows[name]
+        self.participation[row] = UNKNOWN if value == '-' else (ACCEPTED if value else REFUSED)
+        self.__dirty[row] = True
+
+    def setAccuracy(self, name, accuracy):
+        """@setAccuracy
+
+        @:param accuracy: accuracy reported by the client, [loss, accuracy] or None / '-' when unknown.
+        """
+        if isinstance(accuracy, (list, tuple)):
+            accuracy = accuracy[-1] if accuracy else None
+        try:
+            value = float(accuracy)
+        except (TypeError, ValueError):
+            value = np.nan
+        row = self.__rows[name]
+        self.accuracy[row] = value
+        self.__dirty[row] = True
+
+    def updateTraffic(self, traffic, latency):
+        """@updateTraffic
+
+        Compares the counters of all clients with the stored ones in one pass and marks changed rows.
+
+        @:param traffic: (bytes sent, bytes received) of every client, in row order.
+        @:param latency: last latency of every client in seconds, None when unknown.
+        """
+        traffic = np.array(traffic, dtype=np.int64).reshape(-1, 2)
+        latency = np.array(latency, dtype=np.float32)
+        changed = ((traffic[:, 0] != self.bytesSent) | (traffic[:, 1] != self.bytesReceived)
+                   | ~np.isclose(self.latency, latency, equal_nan=True))
+        self.bytesSent[changed] = traffic[changed, 0]
+        self.bytesReceived[changed] = traffic[changed, 1]
+        self.latency[changed] = latency[changed]
+        self.__dirty |= changed
+
+    def takeDirty(self):
+        """@takeDirty
+
+        :return: sorted indexes of rows changed since the last call.
+        """
+        rows = np.flatnonzero(self.__dirty)
+        self.__dirty[rows] = False
+        return rows
@@ -0,0 +1,74 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QColor
+
+import clientState
+
+COLUMNS = ('Name', 'Endpoint', 'Participation', 'Accuracy', 'Last latency', 'Sent / received')
+PARTICIPATION = {clientState.UNKNOWN: ('-', None),
+                 clientState.REFUSED: ('refused', QColor('#c00000')),
+                 clientState.ACCEPTED: ('accepted', QColor('#00c000'))}
+
+
+def formatBytes(count):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB':
+            return str(int(count)) + ' ' + unit if unit == 'B' else '{:.1f} {}'.format(count, unit)
+        count /= 1024
+
+
+class ClientTableModel(QAbstractTableModel):
+    """@ClientTableModel
+
+    Table model over a ClientStateStore. Cells are formatted only when the view asks for them, which it
+    does for visible rows, so the cost of the client list does not grow with the number of clients.
+    """
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.__store = store
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.__store)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        store = self.__store
+        row = index.row()
+        column = index.column()
+        if role == Qt.ForegroundRole and column == 2:
+            return PARTICIPATION[int(store.participation[row])][1]
+        if role != Qt.DisplayRole:
+            return None
+
+        if column == 0:
+            return store.names[row]
+        if column == 1:
+            return store.endpoints[row]
+        if column == 2:
+            return PARTICIPATION[int(store.participation[row])][0]
+        if column == 3:
+            accuracy = store.accuracy[row]
+            return '-' if np.isnan(accuracy) else '{:.3f}'.format(accuracy)
+        if column == 4:
+            latency = store.latency[row]
+            return '-' if np.isnan(latency) else '{:.0f} ms'.format(latency * 1000)
+        return formatBytes(store.bytesSent[row]) + ' / ' + formatBytes(store.bytesReceived[row])
+
+    def refresh(self):
+        """@refresh
+
+        Notifies views about rows changed in the store since the last refresh.
+        """
+        rows = self.__store.takeDirty()
+        if len(rows):
+            self.dataChanged.emit(self.index(int(rows[0]), 0), self.index(int(rows[-1]), len(COLUMNS) - 1))
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+import datasetShards
+from imgSrc import learnDir
+
+
+def measure(model, paths, labels, repeats=20):
+    """@measure
+
+    :return: dict with median single image latency in ms, batch throughput in images/s and accuracy on paths.
+    """
+    image = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    model.infer(image)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.infer(image)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    _, probabilities, _ = model.predictBatch(paths)
+    duration = time.perf_counter() - start
+    accuracy = float(np.mean(np.argmax(probabilities, axis=1) == labels)) if len(labels) else None
+    return {'latency': 1000 * float(np.median(latencies)),
+            'throughput': len(paths) / duration if duration else None,
+            'accuracy': accuracy}
+
+
+def compareBackends(netType, checkpoint=None, quantizations=('dynamic', 'float16'), threads=None, limit=None):
+    """@compareBackends
+
+    Measures the keras inference path and TFLite backends of one net on the test split.
+
+    @:param checkpoint str: head checkpoint (see convModel.saveCheckpoint), None for an untrained head.
+    @:param limit int: number of test images used, all if None.
+    """
+    from convNet1 import convModel
+
+    model = convModel()
+    if checkpoint is not None:
+        model.loadCheckpoint(checkpoint, False)
+    else:
+        model.setNet(netType, False)
+    paths, labels, _ = datasetShards.listImages(os.path.join(learnDir, 'test'))
+    if limit is not None:
+        paths, labels = paths[:limit], labels[:limit]
+
+    results = [('keras', sum(w.nbytes for w in model.getWeights()), measure(model, paths, labels))]
+    for quantization in quantizations:
+        model.setInferenceBackend('tflite', quantization, threads)
+        result = measure(model, paths, labels)
+        results.append(('tflite ' + str(quantization), model.getInferenceBackend().getModelSize(), result))
+    model.setInferenceBackend('keras')
+
+    reference = results[0][2]['accuracy']
+    print(netType + ', ' + str(len(paths)) + ' test images')
+    print('{:<18}{:>12}{:>14}{:>16}{:>12}{:>12}'.format('backend', 'size MB', 'latency ms', 'images/s',
+                                                       'accuracy', 'delta'))
+    for name, size, result in results:
+        accuracy = result['accuracy']
+        delta = None if accuracy is None or reference is None else accuracy - reference
+        print('{:<18}{:>12.2f}{:>14.2f}{:>16.1f}{:>12}{:>12}'.format(
+            name, size / 1e6, result['latency'], result['throughput'] or 0.0,
+            'n/a' if accuracy is None else '{:.4f}'.format(accuracy),
+            'n/a' if delta is None else '{:+.4f}'.format(delta)))
+    print()
+    return results
+
+
+if __name__ == '__main__':
+    net = sys.argv[1] if len(sys.argv) > 1 else 'vgg'
+    compareBackends(net, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -11,4 +11,5 @@ class ComCodes(Enum):
     PREDICT = 6
     POST_ACCURACY = 7
     GET_ACCURACY = 8
-    IS_PARTICIPANT = 9
\ No newline at end of file
+    IS_PARTICIPANT = 9
+    SET_TRANSFER_MODE = 10
\ No newline at end of file
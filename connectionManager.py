@@ -0,0 +1,465 @@
+import selectors
+import socket
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+import framing
+import payloadCodecs
+import tensorFormat
+from comunicationCodes import ComCodes
+
+
+class PeerConnection:
+    """@PeerConnection
+
+    Base class for a peer reached through a pair of sockets: one the peer listens on (send side)
+    and one the peer writes to (listen side). Sockets are owned by ConnectionManager; subclasses
+    only implement handleMessage.
+    """
+
+    def __init__(self, name, host, sendPort, listenPort):
+        self.__name = name
+        self.__host = host
+        self.__sendPort = sendPort
+        self.__listenPort = listenPort
+        self.__manager = None
+        self.__sendChannel = None
+        self.__transferMode = 'float32'
+        self.__codec = None
+        self.__events = None
+
+        self.__pending = {}
+        self.__pendingMutex = threading.Lock()
+        self.__lastRequestId = 0
+        self.__lost = None
+        self.__connectedChannels = 0
+        # set once both sockets are connected or the connection is lost
+        self.__settled = threading.Event()
+
+        self.__bytesSent = 0
+        self.__bytesReceived = 0
+        self.__lastLatency = None
+
+    def getName(self):
+        return self.__name
+
+    def getHost(self):
+        return self.__host
+
+    def getSendPort(self):
+        return self.__sendPort
+
+    def getListenPort(self):
+        return self.__listenPort
+
+    def getConnectionDetails(self):
+        return self.__host + ':' + str(self.__sendPort) + ', ' + str(self.__listenPort)
+
+    def getTraffic(self):
+        """@getTraffic
+
+        :return: (bytes sent, bytes received) including frame headers.
+        """
+        return self.__bytesSent, self.__bytesReceived
+
+    def getLastLatency(self):
+        """@getLastLatency
+
+        :return: seconds between sending the last answered request and receiving its reply, None before any.
+        """
+        return self.__lastLatency
+
+    def setEventBus(self, events):
+        """@setEventBus
+
+        @:param events UiEventBus: receives status changes of this connection, None to drop them.
+        """
+        self.__events = events
+
+    def postEvent(self, kind, target=None, value=None):
+        if self.__events is not None:
+            self.__events.post(kind, target, value)
+
+    def isLost(self):
+        """@isLost
+
+        :return: True once a socket of this peer closed; the connection is not reopened.
+        """
+        return self.__lost is not None
+
+    def isConnected(self):
+        return self.__settled.is_set() and self.__lost is None
+
+    def waitConnected(self, timeout=None):
+        """@waitConnected
+
+        Waits until both sockets of this peer are connected. Raises ConnectionError if the connection is lost.
+
+        :return: True once connected, False if timeout seconds passed first.
+        """
+        self.__settled.wait(timeout)
+        if self.__lost is not None:
+            raise self.__lostError()
+        return self.__settled.is_set()
+
+    def __lostError(self):
+        return ConnectionError(self.__name + ' disconnected: ' + str(self.__lost))
+
+    def attach(self, manager, sendChannel):
+        self.__manager = manager
+        self.__sendChannel = sendChannel
+
+    def getTransferMode(self):
+        return self.__transferMode
+
+    def requestTransferMode(self, mode):
+        """@requestTransferMode
+
+        Asks the peer to exchange weights in given precision. Both sides switch once the peer
+        answers with SET_TRANSFER_MODE and the mode it accepted.
+
+        @:param mode str: one of tensorFormat.TRANSFER_MODES.
+        """
+        if mode not in tensorFormat.TRANSFER_MODES:
+            raise ValueError('Unknown transfer mode ' + str(mode) + ', expected one of ' + str(tensorFormat.TRANSFER_MODES))
+        self.send([ComCodes.SET_TRANSFER_MODE, mode])
+
+    def setCodec(self, codec):
+        """@setCodec
+
+        @:param codec: payloadCodecs id or name used for every message, None to pick one per message.
+        """
+        if codec is not None:
+            payloadCodecs.getCodec(codec)
+        self.__codec = codec
+
+    def getCodec(self):
+        return self.__codec
+
+    def encode(self, message, requestId=0):
+        """@encode
+
+        :return: frame buffers of message in the transfer mode and codec of this connection. They can be
+            sent with sendEncoded, also on other connections with the same transfer mode and codec.
+        """
+        return framing.encodeMessage(message, requestId, self.__transferMode, self.__codec)
+
+    def send(self, message, requestId=0):
+        """@send
+
+        Queues message for sending. Can be called from any thread; messages sent before the
+        connection is established are delivered once it is. Raises ConnectionError once the
+        connection is lost.
+
+        @:param message list: message in form [ComCodes, *args].
+        """
+        if self.__lost is not None:
+            raise self.__lostError()
+        self.sendEncoded(self.encode(message, requestId))
+
+    def sendEncoded(self, buffers):
+        """@sendEncoded
+
+        Queues frame buffers returned by encode. The buffers are not copied and must not be changed.
+        """
+        if self.__manager is None:
+            raise RuntimeError(self.__name + ' is not registered in a ConnectionManager')
+        if self.__lost is not None:
+            raise self.__lostError()
+        self.__manager.send(self.__sendChannel, buffers)
+        with self.__pendingMutex:
+            self.__bytesSent += sum(memoryview(b).nbytes for b in buffers)
+
+    def request(self, code, *args):
+        """@request
+
+        Sends [code, *args] under a new request id. Any number of requests can be in flight; the peer
+        echoes the id in its reply, which resolves the returned future instead of going to handleMessage.
+
+        @:param code ComCodes: command.
+        :return: concurrent.futures.Future resolved with the reply message on the connection manager thread,
+            failed with ConnectionError when the connection is or gets lost before the reply.
+        """
+        future = Future()
+        with self.__pendingMutex:
+            if self.__lost is not None:
+                future.set_exception(self.__lostError())
+                return future
+            self.__lastRequestId = self.__lastRequestId % 0xFFFFFFFF + 1
+            requestId = self.__lastRequestId
+            self.__pending[requestId] = future
+        sent = time.perf_counter()
+        future.add_done_callback(lambda f: self.__forgetRequest(requestId, sent, f))
+        try:
+            self.send([code] + list(args), requestId)
+        except Exception as e:
+            with self.__pendingMutex:
+                # connectionLost may have failed the future already
+                owned = self.__pending.pop(requestId, None) is future
+            if owned:
+                future.set_exception(e)
+        return future
+
+    def __forgetRequest(self, requestId, sent, future):
+        with self.__pendingMutex:
+            self.__pending.pop(requestId, None)
+        if not future.cancelled() and future.exception() is None:
+            self.__lastLatency = time.perf_counter() - sent
+
+    def __resolveRequest(self, header, message):
+        if header.requestId == 0:
+            return False
+        with self.__pendingMutex:
+            future = self.__pending.pop(header.requestId, None)
+        if future is None:
+            return False
+        if future.set_running_or_notify_cancel():
+            future.set_result(message)
+        return True
+
+    def connectionLost(self, error):
+        """@connectionLost
+
+        Called by ConnectionManager when a socket of this peer closes. Fails pending requests and
+        reports the disconnection once per peer, whichever of its sockets closes first.
+        """
+        with self.__pendingMutex:
+            if self.__lost is not None:
+                return
+            self.__lost = error
+            pending = list(self.__pending.values())
+            self.__pending.clear()
+        self.__settled.set()
+        for future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(self.__lostError())
+        self.onDisconnected(error)
+
+    def channelConnected(self):
+        """@channelConnected
+
+        Called by ConnectionManager when a socket of this peer connects; onConnected runs once both did.
+        """
+        with self.__pendingMutex:
+            self.__connectedChannels += 1
+            if self.__connectedChannels < 2 or self.__lost is not None:
+                return
+            self.__settled.set()
+        self.onConnected()
+
+    def onConnected(self):
+        print(self.__name, 'connected on ports', self.__listenPort, self.__sendPort)
+
+    def onDisconnected(self, error):
+        print(self.__name, 'disconnected:', error)
+
+    def dispatch(self, header, message):
+        """@dispatch
+
+        Handles protocol level messages, resolves replies to pending requests and passes the rest
+        to handleMessage.
+        """
+        self.__bytesReceived += framing.HEADER_SIZE + header.length
+        if message[0] == ComCodes.SET_TRANSFER_MODE:
+            if message[1] in tensorFormat.TRANSFER_MODES:
+                self.__transferMode = message[1]
+            print(self.__name, 'transfer mode:', self.__transferMode)
+            return
+        if self.__resolveRequest(header, message):
+            return
+        self.handleMessage(header, message)
+
+    def handleMessage(self, header, message):
+        """@handleMessage
+
+        Called on the connection manager thread for every received message that is not a reply
+        to a request.
+
+        @:param header framing.FrameHeader: frame header.
+        @:param message list: decoded message in form [ComCodes, *args].
+        """
+        raise NotImplementedError
+
+
+class _Channel:
+
+    def __init__(self, connection, port, reading):
+        self.connection = connection
+        self.address = (connection.getHost(), port)
+        self.reading = reading
+        self.sock = None
+        self.connected = False
+        self.closed = False
+        self.events = 0
+        self.reader = framing.FrameReader() if reading else None
+        self.outgoing = deque()
+        self.mutex = threading.Lock()
+
+
+class ConnectionManager(threading.Thread):
+    """@ConnectionManager
+
+    Single selector loop owning the sockets of every registered PeerConnection. Incoming frames
+    are decoded and dispatched to PeerConnection.handleMessage; outgoing frames are queued by
+    send and written when the socket is writable.
+    """
+
+    def __init__(self):
+        super().__init__(name='connection-manager', daemon=True)
+
+        self.__selector = selectors.DefaultSelector()
+        self.__wakeReader, self.__wakeWriter = socket.socketpair()
+        self.__wakeReader.setblocking(False)
+        self.__wakeWriter.setblocking(False)
+        self.__selector.register(self.__wakeReader, selectors.EVENT_READ)
+
+        self.__mutex = threading.Lock()
+        self.__dirty = set()
+        self.__running = True
+
+    def register(self, connection):
+        listenChannel = _Channel(connection, connection.getListenPort(), True)
+        sendChannel = _Channel(connection, connection.getSendPort(), False)
+        connection.attach(self, sendChannel)
+        self.__schedule(listenChannel)
+        self.__schedule(sendChannel)
+
+    def send(self, channel, buffers):
+        with channel.mutex:
+            if channel.closed:
+                raise ConnectionError('Channel to ' + str(channel.address) + ' is closed')
+            for buffer in buffers:
+                channel.outgoing.append(memoryview(buffer).cast('B'))
+        self.__schedule(channel)
+
+    def stop(self):
+        self.__running = False
+        self.__wake()
+
+    def __schedule(self, channel):
+        with self.__mutex:
+            self.__dirty.add(channel)
+        self.__wake()
+
+    def __wake(self):
+        try:
+            self.__wakeWriter.send(b'\0')
+        except BlockingIOError:
+            # wake-up already pending
+            pass
+
+    def __drainWake(self):
+        try:
+            while self.__wakeReader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def __open(self, channel):
+        channel.sock = socket.socket()
+        channel.sock.setblocking(False)
+        channel.sock.connect_ex(channel.address)
+
+    def __updateEvents(self, channel):
+        if channel.closed:
+            events = 0
+        elif not channel.connected:
+            events = selectors.EVENT_WRITE
+        elif channel.reading:
+            events = selectors.EVENT_READ
+        else:
+            with channel.mutex:
+                events = selectors.EVENT_WRITE if channel.outgoing else 0
+
+        if events == channel.events:
+            return
+        if channel.events == 0:
+            self.__selector.register(channel.sock, events, channel)
+        elif events == 0:
+            self.__selector.unregister(channel.sock)
+        else:
+            self.__selector.modify(channel.sock, events, channel)
+        channel.events = events
+
+    def __processDirty(self):
+        with self.__mutex:
+            dirty = self.__dirty
+            self.__dirty = set()
+        for channel in dirty:
+            if channel.closed:
+                continue
+            try:
+                if channel.sock is None:
+                    self.__open(channel)
+                self.__updateEvents(channel)
+            except OSError as e:
+                self.__close(channel, e)
+
+    def __finishConnect(self, channel):
+        error = channel.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error != 0:
+            raise ConnectionRefusedError(error, 'Cannot connect to ' + str(channel.address))
+        channel.connected = True
+        channel.connection.channelConnected()
+
+    def __handleWritable(self, channel):
+        with channel.mutex:
+            while channel.outgoing:
+                view = channel.outgoing[0]
+                try:
+                    n = channel.sock.send(view)
+                except (BlockingIOError, InterruptedError):
+                    return
+                if n < len(view):
+                    channel.outgoing[0] = view[n:]
+                    return
+                channel.outgoing.popleft()
+
+    def __handleReadable(self, channel):
+        for header, payload in channel.reader.readFrom(channel.sock):
+            try:
+                message = framing.decodeMessage(header, payload)
+                channel.connection.dispatch(header, message)
+            except Exception:
+                traceback.print_exc()
+
+    def __close(self, channel, error):
+        if channel.events != 0:
+            self.__selector.unregister(channel.sock)
+            channel.events = 0
+        if channel.sock is not None:
+            channel.sock.close()
+        with channel.mutex:
+            channel.closed = True
+            # nothing queued can be delivered any more
+            channel.outgoing.clear()
+        channel.connection.connectionLost(error)
+
+    def run(self):
+        while self.__running:
+            for key, events in self.__selector.select():
+                channel = key.data
+                if channel is None:
+                    self.__drainWake()
+                    continue
+                if channel.closed:
+                    continue
+                try:
+                    if not channel.connected:
+                        self.__finishConnect(channel)
+                    elif events & selectors.EVENT_READ:
+                        self.__handleReadable(channel)
+                    elif events & selectors.EVENT_WRITE:
+                        self.__handleWritable(channel)
+                    self.__updateEvents(channel)
+                except OSError as e:
+                    self.__close(channel, e)
+            self.__processDirty()
+
+        for key in list(self.__selector.get_map().values()):
+            key.fileobj.close()
+        self.__wakeWriter.close()
+        self.__selector.close()
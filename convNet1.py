@@ -1,4 +1,3 @@
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 import tensorflow as tf
 from tensorflow.keras import layers, models, backend
 from keras.utils import plot_model
@@ -10,37 +9,357 @@ import numpy as np
 from numba import cuda
 from imgSrc import learnDir, __main as main, covid_classes
 import os
+import threading
+from collections import OrderedDict
+import json
 import matplotlib.pyplot as plt
 import seaborn as sns
 import utils
+import tensorFormat
+import weightDelta
+from featureCache import FeatureCache
+import datasetShards
+from modelCache import ModelCache, modelBytes
 
 physical_devices = tf.config.list_physical_devices()
 tf.config.set_visible_devices([], 'GPU')
 
 class convModel:
-    def __init__(self, trainPath='proxy'):
+    def __init__(self, trainPath='proxy', modelCacheBudget=2 * 1024 ** 3):
         self.__name = trainPath
         self.__model = models.Sequential()
         self.__trainPath = os.path.join(learnDir, 'train', trainPath)
         self.__testPath = os.path.join(learnDir, 'test')
         self.__modelPath = os.path.join(main, 'models')
         self.__modelType = ''
+        self.__netTag = None
+        self.__weightsVersion = 0
+        self.__deltaEncoder = weightDelta.DeltaEncoder()
+        self.__modelCache = ModelCache(modelCacheBudget)
 
         self.__history = None
-        self.__train_gen = ImageDataGenerator()
-        self.__val_gen = ImageDataGenerator()
-        self.__gpu = cuda.get_current_device()
+        # looked up on first use, CPU only machines have none
+        self.__gpu = None
         self.__batchSize = 64
         self.__seed = 101
         self.__xSize = 224
         self.__ySize = 224
 
+        self.__evaluation = None
+        self.__transferCopy = None
+        self.__datasetCache = None
+        self.__shardDir = os.path.join(main, 'learning_dataset_shards')
+        self.__datasets = {}
+        self.__augmenter = None
+
+        self.__useFeatureCache = False
+        self.__featureCacheDir = os.path.join(main, 'feature_cache')
+        self.__featureCache = None
+        self.__extractor = None
+        self.__head = None
+
+        self.__inference = None
+        self.__imageCache = OrderedDict()
+        self.__imageCacheSize = 32
+        self.__tflite = None
+        self.__tfliteVersion = None
+        self.__tfliteMutex = threading.Lock()
+        self.__warmUpPending = threading.Event()
+        self.__warmUpThread = None
+
     def getModelType(self):
         return self.__modelType
 
+    def getGpu(self):
+        """@getGpu
+
+        :return: current numba CUDA device, raises if there is none.
+        """
+        if self.__gpu is None:
+            self.__gpu = cuda.get_current_device()
+        return self.__gpu
+
+    def getWeightsVersion(self):
+        return self.__weightsVersion
+
+    def __weightsChanged(self):
+        self.__weightsVersion += 1
+        self.__requestWarmUp()
+
+    def __modelChanged(self, netTag=None):
+        """@__modelChanged
+
+        @:param netTag str: setNet type of the new model, None if it was not built by a net builder.
+        """
+        self.__netTag = netTag
+        self.__featureCache = None
+        self.__extractor = None
+        self.__head = None
+        self.__evaluation = None
+        self.__transferCopy = None
+        self.__inference = None
+        self.__weightsChanged()
+
+    def __inferenceFunction(self):
+        # kept with the model it calls: the warm-up thread may build it while the model is being replaced
+        model = self.__model
+        inference = self.__inference
+        if inference is None or inference[0] is not model:
+
+            @tf.function(input_signature=[tf.TensorSpec((None, self.__xSize, self.__ySize, 3), tf.float32)])
+            def function(images):
+                return model(images, training=False)
+
+            inference = (model, function)
+            self.__inference = inference
+        return inference[1]
+
+    def infer(self, images):
+        """@infer
+
+        Calls the model directly through a compiled function with a fixed input signature, without the
+        per call setup of Model.predict, or through the TFLite backend if one is set.
+
+        @:param images: (n, xSize, ySize, 3) array or tensor.
+        :return: (n, classes) np.array of class probabilities.
+        """
+        tflite = self.__tflite
+        if tflite is not None:
+            with self.__tfliteMutex:
+                if self.__tfliteVersion != self.__weightsVersion:
+                    version = self.__weightsVersion
+                    tflite.convert(self.__model)
+                    self.__tfliteVersion = version
+            return tflite.infer(np.asarray(images))
+        return self.__inferenceFunction()(tf.cast(images, tf.float32)).numpy()
+
+    def setInferenceBackend(self, backend='keras', quantization='dynamic', threads=None):
+        """@setInferenceBackend
+
+        @:param backend str: 'keras' for the compiled keras function, 'tflite' for a TFLite interpreter
+            (see TFLiteBackend). The TFLite model is converted again after every weights change.
+        @:param quantization str: TFLite quantization, 'dynamic', 'float16' or None.
+        @:param threads int: TFLite interpreter threads.
+        """
+        if backend == 'keras':
+            self.__tflite = None
+        elif backend == 'tflite':
+            from tfliteBackend import TFLiteBackend
+            self.__tflite = TFLiteBackend(quantization, threads)
+            self.__tfliteVersion = None
+            self.__requestWarmUp()
+        else:
+            raise ValueError('Unknown inference backend ' + str(backend) + ", expected 'keras' or 'tflite'")
+
+    def getInferenceBackend(self):
+        return self.__tflite
+
+    def warmUp(self):
+        """@warmUp
+
+        Traces the inference function and runs it once, so the first prediction does not pay for it.
+        Runs automatically in the background after every model or weights change.
+        """
+        if self.__model.built:
+            self.infer(np.zeros((1, self.__xSize, self.__ySize, 3), dtype=np.float32))
+
+    def __requestWarmUp(self):
+        self.__warmUpPending.set()
+        if self.__warmUpThread is None:
+            self.__warmUpThread = threading.Thread(target=self.__warmUpLoop, name='inference-warm-up', daemon=True)
+            self.__warmUpThread.start()
+
+    def __warmUpLoop(self):
+        while True:
+            self.__warmUpPending.wait()
+            # changes made while warming up are covered by the next pass
+            self.__warmUpPending.clear()
+            try:
+                self.warmUp()
+            except Exception as e:
+                print('Inference warm-up failed:', e)
+
+    def enableFeatureCache(self, enabled=True, cacheDir=None):
+        """@enableFeatureCache
+
+        In feature cache mode the frozen backbone runs once per image; its pooled features are kept in an
+        on-disk cache (see FeatureCache) and training and evaluation only run the dense head on them.
+        Training images are not augmented in this mode.
+
+        @:param enabled bool: turns feature cache mode on or off.
+        @:param cacheDir str: cache location, <main>/feature_cache by default.
+        """
+        self.__useFeatureCache = enabled
+        if cacheDir is not None and cacheDir != self.__featureCacheDir:
+            self.__featureCacheDir = cacheDir
+            self.__featureCache = None
+
+    def __headModels(self):
+        """@__headModels
+
+        :return: (extractor, head) - model from input image to pooled features and model from pooled
+            features to prediction. Both share layers, and so weights, with the full model.
+        """
+        if self.__head is None:
+            pooling = self.__model.layers[2]
+            self.__extractor = tf.keras.Model(self.__model.input, pooling.output)
+            features = layers.Input(shape=pooling.output.shape[1:])
+            x = features
+            for layer in self.__model.layers[3:]:
+                x = layer(x)
+            self.__head = tf.keras.Model(features, x)
+            self.__head.compile(optimizer='adam',
+                                loss='categorical_crossentropy',
+                                metrics=['accuracy'])
+        if self.__featureCache is None:
+            key = self.__modelType + '_' + str(self.__xSize) + 'x' + str(self.__ySize)
+            self.__featureCache = FeatureCache(self.__featureCacheDir, key, int(self.__head.input.shape[-1]))
+        return self.__extractor, self.__head
+
+    def __listImages(self, directory):
+        return datasetShards.listImages(directory)
+
+    def __cachedFeatures(self, directory):
+        """@__cachedFeatures
+
+        :return: (features, one hot labels) of all images in directory, computing missing features first.
+        """
+        extractor, _ = self.__headModels()
+        paths, labels, classes = self.__listImages(directory)
+        missing = self.__featureCache.missing(paths)
+        if missing:
+            images = self.__imageDataset(missing, np.zeros(len(missing), dtype=np.int64), 1)
+            self.__featureCache.store(missing, extractor.predict(images.map(lambda x, y: x)))
+        return self.__featureCache.load(paths), tf.keras.utils.to_categorical(labels, len(classes))
+
+    def setDatasetCache(self, cache):
+        """@setDatasetCache
+
+        @:param cache: None to decode images on every pass, 'memory' to keep decoded images in memory or
+            a directory where decoded images are cached in files. Cached pipelines are reused between calls.
+        """
+        if cache is not None and cache != 'memory':
+            os.makedirs(cache, exist_ok=True)
+        self.__datasetCache = cache
+        self.__datasets = {}
+
+    def __decodeImage(self, path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        # nearest neighbour keeps uint8 and matches load_img resizing
+        image = tf.image.resize(image, (self.__xSize, self.__ySize), method='nearest')
+        image.set_shape((self.__xSize, self.__ySize, 3))
+        return image, label
+
+    def __augment(self, images, labels):
+        """@__augment
+
+        Random horizontal flip, rotation up to 90 degrees and brightness in [0.2, 1.0], applied to a whole batch.
+        """
+        if self.__augmenter is None:
+            self.__augmenter = tf.keras.Sequential([layers.RandomFlip('horizontal'),
+                                                    layers.RandomRotation(0.25, fill_mode='nearest')])
+        images = self.__augmenter(images, training=True)
+        brightness = tf.random.uniform((tf.shape(images)[0], 1, 1, 1), 0.2, 1.0)
+        return tf.clip_by_value(images * brightness, 0.0, 255.0), labels
+
+    def __imageDataset(self, paths, labels, nclasses, augment=False, shuffle=False, cacheName=None):
+        dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+        if shuffle and cacheName is None:
+            dataset = dataset.shuffle(len(paths), seed=42, reshuffle_each_iteration=True)
+        dataset = dataset.map(self.__decodeImage, num_parallel_calls=tf.data.AUTOTUNE)
+        if cacheName is not None:
+            if self.__datasetCache == 'memory':
+                dataset = dataset.cache()
+            else:
+                dataset = dataset.cache(os.path.join(self.__datasetCache, cacheName))
+            if shuffle:
+                dataset = dataset.shuffle(min(len(paths), 16 * self.__batchSize), seed=42,
+                                          reshuffle_each_iteration=True)
+        return self.__finishDataset(dataset.batch(self.__batchSize), nclasses, augment)
+
+    def __finishDataset(self, dataset, nclasses, augment):
+        dataset = dataset.map(lambda x, y: (tf.cast(x, tf.float32), tf.one_hot(y, nclasses)),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+        if augment:
+            dataset = dataset.map(self.__augment, num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def setShardDir(self, shardDir):
+        """@setShardDir
+
+        @:param shardDir str: root of the compiled dataset (see datasetShards.compileDataset), None to
+            always decode image files.
+        """
+        self.__shardDir = shardDir
+
+    def loadShards(self, directory, paths=None):
+        """@loadShards
+
+        :return: ShardedDataset of split directory, None if it was not compiled, was compiled for another
+            image size or its images changed since.
+        """
+        if self.__shardDir is None:
+            return None
+        path = datasetShards.shardPath(learnDir, self.__shardDir, directory)
+        if path is None or not os.path.exists(os.path.join(path, 'index.json')):
+            return None
+        shards = datasetShards.ShardedDataset(path)
+        if paths is None:
+            paths = self.__listImages(directory)[0]
+        if shards.getSize() != (self.__xSize, self.__ySize) or not shards.isCurrent(paths):
+            print('Compiled dataset', path, 'is out of date, decoding images')
+            return None
+        return shards
+
+    def __shardDataset(self, shards, augment, shuffle):
+        size = shards.getSize()
+        dataset = tf.data.Dataset.from_generator(
+            lambda: shards.batches(self.__batchSize, shuffle),
+            output_signature=(tf.TensorSpec((None, size[0], size[1], 3), tf.uint8),
+                              tf.TensorSpec((None,), tf.int64)))
+        return self.__finishDataset(dataset, len(shards.getClasses()), augment)
+
+    def buildDataset(self, directory, augment=False, shuffle=False):
+        """@buildDataset
+
+        Input pipeline over images in class subdirectories of directory. Images are read from compiled
+        shards when available (see loadShards), otherwise decoded and resized in parallel and optionally
+        cached (see setDatasetCache). Batches are augmented and prefetched.
+
+        @:param augment bool: apply random flip, rotation and brightness.
+        @:param shuffle bool: reshuffle images every epoch. Without shuffling batches follow the order of labels.
+        :return: (tf.data.Dataset of (images, one hot labels) batches, labels, classes)
+        """
+        key = (os.path.abspath(directory), augment, shuffle)
+        if self.__datasetCache is not None and key in self.__datasets:
+            return self.__datasets[key]
+
+        paths, labels, classes = self.__listImages(directory)
+        shards = self.loadShards(directory, paths)
+        if shards is not None:
+            # compiled shards are already decoded and memory mapped, no cache needed
+            return self.__shardDataset(shards, augment, shuffle), labels, classes
+
+        cacheName = None
+        if self.__datasetCache is not None:
+            cacheName = key[0].strip(os.sep).replace(os.sep, '_').replace(':', '')
+        dataset = self.__imageDataset(paths, labels, len(classes), augment, shuffle, cacheName)
+        result = (dataset, labels, classes)
+        if self.__datasetCache is not None:
+            self.__datasets[key] = result
+        return result
+
     def getPaths(self):
         return 'train: ' + self.__trainPath + ', test: ' + self.__testPath + ', save: ' + self.__modelPath
 
+    def setTestPath(self, testPath):
+        """@setTestPath
+
+        @:param testPath str: directory with class subdirectories used by evaluateFull and as default
+            validation set, <learnDir>/test by default.
+        """
+        self.__testPath = testPath
+
     def __compileModel(self, optimizer='adam', loss='categorical_crossentropy', metrics=None):
         print('compiling')
         if metrics is None:
@@ -56,35 +375,101 @@ class convModel:
         for layer in Layers:
             self.__model.add(layer)
         self.__compileModel()
+        self.__modelChanged()
+
+    def getAccuracy(self, transferMode=None):
+        """@getAccuracy
+
+        @:param transferMode str: if set, trainable weights are evaluated as they look after a transfer in
+            this mode (see tensorFormat.TRANSFER_MODES) and the accuracy change is reported. The transferred
+            weights are evaluated on a copy of the model, the model itself is not changed.
+        :return: [loss, accuracy] or, with transferMode, [loss, accuracy, accuracy delta] where loss and
+            accuracy are measured with transferred weights and delta is relative to full precision.
+        """
+        evaluation = self.evaluateFull()
+        result = [evaluation['loss'], evaluation['accuracy']]
+        if transferMode is None:
+            return result
 
-    def getAccuracy(self):
-        valid_datagen = ImageDataGenerator()
-        valid_generator = valid_datagen.flow_from_directory(
-            directory=self.__testPath,
-            target_size=(self.__xSize, self.__ySize),
-            color_mode="rgb",
-            batch_size=self.__batchSize,
-            class_mode="categorical",
-            shuffle=True,
-            seed=42
-        )
-        return self.__model.evaluate_generator(valid_generator)
+        transferred = self.__scorePredictions(*self.__predictTestSet(transferMode))
+        return [transferred['loss'], transferred['accuracy'], transferred['accuracy'] - result[1]]
+
+    def __transferredCopy(self, model, transferMode):
+        """@__transferredCopy
+
+        :return: copy of model with its trainable weights as the peer sees them after a transfer in
+            transferMode. The copy is built once per model and only gets new weights on later calls.
+        """
+        if self.__transferCopy is None or self.__transferCopy[0] is not model:
+            self.__transferCopy = (model, models.clone_model(model))
+        copy = self.__transferCopy[1]
+        trainable = {w.ref() for w in model.trainable_weights}
+        weights = model.get_weights()
+        indexes = [i for i, w in enumerate(model.weights) if w.ref() in trainable]
+        for i, w in zip(indexes, tensorFormat.roundTrip([weights[i] for i in indexes], transferMode)):
+            weights[i] = w
+        copy.set_weights(weights)
+        return copy
+
+    def __predictTestSet(self, transferMode=None):
+        """@__predictTestSet
+
+        @:param transferMode str: if set, predictions are made with weights as transferred in this mode.
+        :return: (probabilities, true labels, classes) of the test set, in file order.
+        """
+        if self.__useFeatureCache:
+            features, _ = self.__cachedFeatures(self.__testPath)
+            _, labels, classes = self.__listImages(self.__testPath)
+            head = self.__headModels()[1]
+            if transferMode is not None:
+                head = self.__transferredCopy(head, transferMode)
+            return head.predict(features, batch_size=self.__batchSize), labels, classes
+
+        dataset, labels, classes = self.buildDataset(self.__testPath)
+        model = self.__model
+        if transferMode is not None:
+            model = self.__transferredCopy(model, transferMode)
+        return model.predict(dataset), labels, classes
+
+    def __scorePredictions(self, probabilities, labels, classes):
+        nclasses = probabilities.shape[1]
+        predicted = np.argmax(probabilities, axis=1)
+        # categorical crossentropy as computed by keras
+        trueProbabilities = np.clip(probabilities[np.arange(len(labels)), labels], 1e-7, 1.0)
+        matrix = confusion_matrix(labels, predicted, labels=np.arange(nclasses))
+        correct = np.diag(matrix).astype(np.float64)
+        predictedCounts = matrix.sum(axis=0)
+        trueCounts = matrix.sum(axis=1)
+
+        return {'loss': float(-np.mean(np.log(trueProbabilities))),
+                'accuracy': float(correct.sum() / max(len(labels), 1)),
+                'confusionMatrix': matrix,
+                'precision': np.divide(correct, predictedCounts, out=np.zeros(nclasses), where=predictedCounts > 0),
+                'recall': np.divide(correct, trueCounts, out=np.zeros(nclasses), where=trueCounts > 0),
+                'classes': classes,
+                'labels': labels,
+                'probabilities': probabilities}
+
+    def evaluateFull(self):
+        """@evaluateFull
+
+        Runs inference over the test set once, in file order, and derives every metric from the same
+        predictions. The result is memoized by the weights version, which every model or weights change
+        bumps, so repeated calls with unchanged weights return immediately.
+
+        :return: dict with 'loss', 'accuracy', 'confusionMatrix' (rows are true classes), per class
+            'precision' and 'recall', 'classes', true 'labels' and predicted 'probabilities'.
+        """
+        key = (self.__weightsVersion, self.__useFeatureCache, os.path.abspath(self.__testPath))
+        if self.__evaluation is not None and self.__evaluation[0] == key:
+            return self.__evaluation[1]
+
+        result = self.__scorePredictions(*self.__predictTestSet())
+        self.__evaluation = (key, result)
+        return result
 
     def getConfusionMatrix(self, savePath=None):
-        valid_datagen = ImageDataGenerator()
-        valid_generator = valid_datagen.flow_from_directory(
-            directory=self.__testPath,
-            target_size=(self.__xSize, self.__ySize),
-            color_mode="rgb",
-            batch_size=self.__batchSize,
-            class_mode="categorical",
-            shuffle=True,
-            seed=42
-        )
-        Y_pred = self.__model.predict_generator(valid_generator)
-        y_pred = np.argmax(Y_pred, axis=1)
-
-        matrix = confusion_matrix(valid_generator.classes, y_pred)
+        matrix = self.evaluateFull()['confusionMatrix']
         classes = []
         for c in covid_classes:
             classes.append(c[1:])
@@ -116,37 +501,25 @@ class convModel:
         if validationPath is None:
             validationPath = self.__testPath
 
-        train_datagen = ImageDataGenerator(horizontal_flip=True, rotation_range=90, brightness_range=[0.2, 1.0])
-        valid_datagen = ImageDataGenerator(horizontal_flip=True, rotation_range=90, brightness_range=[0.2, 1.0])
-
-        train_generator = train_datagen.flow_from_directory(
-            directory=trainPath,
-            target_size=(self.__xSize, self.__ySize),
-            color_mode="rgb",
-            batch_size=self.__batchSize,
-            class_mode="categorical",
-            shuffle=True,
-            seed=42
-        )
-
-        valid_generator = valid_datagen.flow_from_directory(
-            directory=validationPath,
-            target_size=(self.__xSize, self.__ySize),
-            color_mode="rgb",
-            batch_size=self.__batchSize,
-            class_mode="categorical",
-            shuffle=True,
-            seed=42
-        )
-
-        STEP_SIZE_TRAIN = train_generator.n // train_generator.batch_size
-        STEP_SIZE_VALID = valid_generator.n // valid_generator.batch_size
-        self.__history = self.__model.fit_generator(generator=train_generator,
-                                                    steps_per_epoch=STEP_SIZE_TRAIN,
-                                                    validation_data=valid_generator,
-                                                    validation_steps=STEP_SIZE_VALID,
-                                                    epochs=epohs
-                                                    )
+        if self.__useFeatureCache:
+            features, labels = self.__cachedFeatures(trainPath)
+            validFeatures, validLabels = self.__cachedFeatures(validationPath)
+            self.__history = self.__headModels()[1].fit(features, labels,
+                                                        batch_size=self.__batchSize,
+                                                        validation_data=(validFeatures, validLabels),
+                                                        shuffle=True,
+                                                        epochs=epohs
+                                                        )
+            self.__weightsChanged()
+            return
+
+        train_dataset, _, _ = self.buildDataset(trainPath, augment=True, shuffle=True)
+        valid_dataset, _, _ = self.buildDataset(validationPath)
+        self.__history = self.__model.fit(train_dataset,
+                                          validation_data=valid_dataset,
+                                          epochs=epohs
+                                          )
+        self.__weightsChanged()
 
     def __addTop(self, x, nclasses=3):
 
@@ -164,13 +537,7 @@ class convModel:
         vgg.trainable = False
         input_l = layers.Input(shape=(self.__xSize, self.__ySize, 3))
         x = vgg(input_l, training=False)
-        x = layers.GlobalAveragePooling2D()(x)
-        x = layers.Dense(1000, activation='relu')(x)
-        x = layers.Dropout(0.3)(x)
-        x = layers.Dense(500, activation='relu')(x)
-        x = layers.Dropout(0.3)(x)
-        x = layers.Dense(200, activation='relu')(x)
-        predict = layers.Dense(nclasses, activation='softmax')(x)
+        predict = self.__addTop(x, nclasses)
         self.__model = tf.keras.Model(input_l, predict)
 
         if summary:
@@ -180,6 +547,7 @@ class convModel:
                              loss='categorical_crossentropy',
                              metrics=['accuracy'])
         self.__modelType = 'vggNet'
+        self.__modelChanged('vgg')
 
     def resNet(self, nclasses=3, summary=True):
         res = ResNet50V2(weights='imagenet', include_top=False, input_shape=(self.__xSize, self.__ySize, 3))
@@ -193,6 +561,7 @@ class convModel:
 
         self.__compileModel()
         self.__modelType = 'ResNet'
+        self.__modelChanged('res')
 
     def inception(self, nclasses=3, summary=True):
         inc = InceptionV3(weights='imagenet', include_top=False, input_shape=(self.__xSize, self.__ySize, 3))
@@ -206,6 +575,7 @@ class convModel:
 
         self.__compileModel()
         self.__modelType = 'InceptionNet'
+        self.__modelChanged('inc')
 
     def saveModelToFile(self, name=''):
         self.__model.save(os.path.join(self.__modelPath, name), overwrite=True, save_format='tf')
@@ -218,6 +588,58 @@ class convModel:
             self.__model.summary()
         self.__compileModel()
         self.__modelType=name
+        self.__modelChanged()
+
+    def __classNames(self):
+        return [c[1:] for c in covid_classes]
+
+    def getNetTag(self):
+        return self.__netTag
+
+    def saveCheckpoint(self, name=''):
+        """@saveCheckpoint
+
+        Saves a head-only checkpoint <modelPath>/<name>.npz holding net type, input size, class names and
+        trainable weights. The frozen ImageNet backbone is not stored; loadCheckpoint rebuilds it.
+
+        :return: path of the checkpoint.
+        """
+        if self.__netTag is None:
+            raise ValueError('Only nets built by setNet can be saved as a checkpoint')
+        meta = {'version': 1,
+                'netTag': self.__netTag,
+                'inputSize': [self.__xSize, self.__ySize],
+                'classes': self.__classNames()}
+        arrays = {'meta': np.array(json.dumps(meta))}
+        for i, w in enumerate(self.__model.trainable_weights):
+            arrays['w' + str(i)] = w.numpy()
+        path = os.path.join(self.__modelPath, self.__checkpointName(name))
+        np.savez(path, **arrays)
+        return path
+
+    def __checkpointName(self, name):
+        return name if name.endswith('.npz') else name + '.npz'
+
+    def loadCheckpoint(self, name='', summary=True):
+        """@loadCheckpoint
+
+        Builds the net stored in a checkpoint of saveCheckpoint through setNet (reusing a cached net when
+        possible) and applies its trainable weights.
+        """
+        path = os.path.join(self.__modelPath, self.__checkpointName(name))
+        with np.load(path, allow_pickle=False) as checkpoint:
+            meta = json.loads(str(checkpoint['meta']))
+            if meta['inputSize'] != [self.__xSize, self.__ySize]:
+                raise ValueError('Checkpoint input size ' + str(meta['inputSize']) + ' does not match '
+                                 + str([self.__xSize, self.__ySize]))
+            weights = [checkpoint['w' + str(i)] for i in range(len(checkpoint.files) - 1)]
+        self.setNet(meta['netTag'], summary)
+        if self.__netTag != meta['netTag']:
+            raise ValueError('Unknown net type ' + str(meta['netTag']) + ' in checkpoint')
+        if self.__model.output.shape[-1] != len(meta['classes']):
+            raise ValueError('Checkpoint has ' + str(len(meta['classes'])) + ' classes, model has '
+                             + str(self.__model.output.shape[-1]))
+        self.setTrainableWeights(weights)
 
     def __unsetTrainable(self):
         self.__model.layers[1].trainable = False
@@ -238,6 +660,7 @@ class convModel:
 
         """
         self.__model = models.model_from_json(json)
+        self.__modelChanged()
 
     def setWeights(self, weights):
         """
@@ -246,23 +669,57 @@ class convModel:
         """
         self.__model.set_weights(weights)
         self.__compileModel()
+        self.__weightsChanged()
 
     def setTrainableWeights(self, weights):
         """@setTrainableWeights
-            @:param weights np.array: numpy array or list of tensor variables. These are only trainable weights.
+            @:param weights np.array: numpy array or list of numpy arrays / tensor variables. These are only
+            trainable weights. Arrays decoded from a tensor message are used as they are, without copying;
+            quantized ones are dequantized here. Only trainable variables are assigned, in place; shapes
+            and dtypes of all weights are checked before any variable is changed.
             """
-        non_trainable = self.__model.non_trainable_weights
-        all_weights = []
-        for i in non_trainable:
-            all_weights.append(i.numpy())
-        if type(weights).__module__ == np.__name__:
-            for i in weights:
-                all_weights.append(i)
-        else:
-            for i in weights:
-                all_weights.append(i.numpy())
+        variables = self.__model.trainable_weights
+        weights = [tensorFormat.dequantize(w) for w in weights]
+        if len(weights) != len(variables):
+            raise ValueError('Expected ' + str(len(variables)) + ' trainable weights, got ' + str(len(weights)))
+
+        for i, (variable, w) in enumerate(zip(variables, weights)):
+            if tuple(variable.shape) != w.shape:
+                raise ValueError('Weight ' + str(i) + ' (' + variable.name + ') has shape ' + str(w.shape)
+                                 + ', expected ' + str(tuple(variable.shape)))
+            dtype = variable.dtype.as_numpy_dtype
+            if w.dtype != dtype:
+                if not (np.issubdtype(w.dtype, np.floating) and np.issubdtype(dtype, np.floating)):
+                    raise ValueError('Weight ' + str(i) + ' (' + variable.name + ') has dtype ' + str(w.dtype)
+                                     + ', expected ' + str(np.dtype(dtype)))
+                weights[i] = w.astype(dtype)
+
+        for variable, w in zip(variables, weights):
+            variable.assign(w)
+        self.__weightsChanged()
+
+    def getTrainableWeightsUpdate(self, peer, baseVersion=None, topK=None, transferMode='float32'):
+        """@getTrainableWeightsUpdate
+
+        @:param peer: identifier of the receiving peer, the last weights it acknowledged are kept per peer.
+        @:param baseVersion int: weights version the peer holds, None for full weights.
+        @:param topK float: fraction of values sent per tensor, None for a dense delta.
+        @:param transferMode str: transfer mode of the peer connection.
+        :return: tuple (list of tensors, update info dict), see weightDelta.
+        """
+        weights = [w.numpy() for w in self.__model.trainable_weights]
+        return self.__deltaEncoder.encode(peer, weights, self.__weightsVersion, baseVersion, topK, transferMode)
 
-        self.__model.set_weights(np.array(all_weights))
+    def applyTrainableWeightsUpdate(self, tensors, info=None):
+        """@applyTrainableWeightsUpdate
+
+        @:param tensors list: tensors of a full, delta or sparse weight update.
+        @:param info dict: update info sent with the tensors, None for a plain list of trainable weights.
+        """
+        base = None
+        if info is not None and info.get('encoding', 'full') != 'full':
+            base = [w.numpy() for w in self.__model.trainable_weights]
+        self.setTrainableWeights(weightDelta.applyUpdate(base, tensors, info))
 
     def learningCurves(self, savePath=None):
         """@learningCurves
@@ -291,15 +748,37 @@ class convModel:
             'vgg' - VGG Net,
             'res' - ResNet,
             'inc' - Inception Net
+            Built nets are kept in a model cache, switching back to one reuses it instead of rebuilding.
         :param summary:
         :return:
         """
+        key = (netType, self.__xSize, self.__ySize)
+        cached = self.__modelCache.get(key)
+        if cached is not None:
+            # built before: only the head weights are replaced afterwards by setTrainableWeights
+            self.__model, self.__modelType = cached
+            if summary:
+                self.__model.summary()
+            self.__modelChanged(netType)
+            return
+
         if netType == 'vgg':
             self.vggNet(summary=summary)
         elif netType == 'inc':
             self.inception(summary=summary)
         elif netType == 'res':
             self.resNet(summary=summary)
+        else:
+            return
+        self.__modelCache.put(key, (self.__model, self.__modelType), modelBytes(self.__model))
+
+    def setModelCacheBudget(self, budget):
+        """@setModelCacheBudget
+
+        @:param budget int: memory in bytes that models built by setNet may keep, least recently used
+            models are dropped first.
+        """
+        self.__modelCache.setBudget(budget)
 
     def getModelGraph(self, savepath='', filename=None):
         """
@@ -377,7 +856,100 @@ class convModel:
         image = np.array(image)
         image = image[None, ...]
 
-        prediction = self.__model.predict(image)
+        prediction = self.infer(image)
         prediction = np.argmax(prediction)
 
         return covid_classes[prediction][1:]
+
+    def __predictionBatches(self, source, batchSize):
+        """@__predictionBatches
+
+        Generator of (keys, images) batches of source; keys are image paths or array indexes.
+        """
+        if isinstance(source, np.ndarray):
+            if source.ndim != 4 or source.shape[1:] != (self.__xSize, self.__ySize, 3):
+                raise ValueError('Expected images of shape (N, ' + str(self.__xSize) + ', ' + str(self.__ySize)
+                                 + ', 3), got ' + str(source.shape))
+            for start in range(0, len(source), batchSize):
+                yield np.arange(start, min(start + batchSize, len(source))), source[start:start + batchSize]
+            return
+
+        if isinstance(source, str):
+            paths = []
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                paths += [os.path.join(root, f) for f in sorted(files)
+                          if f.lower().endswith(datasetShards.IMAGE_EXTENSIONS)]
+        else:
+            paths = list(source)
+        if not paths:
+            return
+
+        # decoding runs in parallel and ahead of inference
+        dataset = tf.data.Dataset.from_tensor_slices(paths)
+        dataset = dataset.map(lambda path: self.__decodeImage(path, 0)[0], num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.batch(batchSize).prefetch(tf.data.AUTOTUNE)
+        for start, images in zip(range(0, len(paths), batchSize), dataset):
+            yield paths[start:start + batchSize], images
+
+    def predictStream(self, source, batchSize=None):
+        """@predictStream
+
+        Generator variant of predictBatch yielding results batch by batch, in input order.
+
+        :return: generator of (keys, probabilities, labels) - image paths (array indexes for array input),
+            (n, classes) class probabilities and predicted class names of one batch.
+        """
+        if batchSize is None:
+            batchSize = self.__batchSize
+        classes = np.array(self.__classNames())
+        for keys, images in self.__predictionBatches(source, batchSize):
+            probabilities = self.infer(images)
+            yield keys, probabilities, classes[np.argmax(probabilities, axis=1)]
+
+    def predictBatch(self, source, batchSize=None):
+        """@predictBatch
+
+        @:param source: list of image paths, directory (searched recursively, in sorted order) or
+            (N, xSize, ySize, 3) array of images.
+        @:param batchSize int: images per inference batch, training batch size by default.
+        :return: (keys, probabilities, labels) - image paths (indexes for array input), (N, classes) class
+            probabilities and predicted class names.
+        """
+        keys = []
+        probabilities = []
+        labels = []
+        for batchKeys, batchProbabilities, batchLabels in self.predictStream(source, batchSize):
+            keys += list(batchKeys)
+            probabilities.append(batchProbabilities)
+            labels.append(batchLabels)
+        if not probabilities:
+            return keys, np.zeros((0, len(self.__classNames())), dtype=np.float32), np.array([], dtype=str)
+        return keys, np.concatenate(probabilities), np.concatenate(labels)
+
+    def __loadPredictionImage(self, path):
+        """@__loadPredictionImage
+
+        :return: (xSize, ySize, 3) uint8 image decoded and resized like training images. Decoded images are
+            cached by path and modification time, so predicting the same file again skips decoding.
+        """
+        mtime = os.path.getmtime(path)
+        cached = self.__imageCache.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.__imageCache.move_to_end(path)
+            return cached[1]
+        image = self.__decodeImage(tf.constant(path), 0)[0].numpy()
+        self.__imageCache[path] = (mtime, image)
+        while len(self.__imageCache) > self.__imageCacheSize:
+            self.__imageCache.popitem(last=False)
+        return image
+
+    def predictFile(self, path):
+        """@predictFile
+
+        @:param path str: image file, read at full resolution and resized by the model preprocessing.
+        :return: predicted class
+        """
+        image = self.__loadPredictionImage(path)
+        prediction = np.argmax(self.infer(image[None, ...]))
+        return self.__classNames()[prediction]
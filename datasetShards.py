@@ -0,0 +1,196 @@
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+FORMAT_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def listImages(directory):
+    """@listImages
+
+    :return: (paths, labels, classes) of images in class subdirectories of directory, classes and files
+        in sorted order.
+    """
+    classes = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    paths = []
+    labels = []
+    for label, c in enumerate(classes):
+        for file in sorted(os.listdir(os.path.join(directory, c))):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(directory, c, file))
+                labels.append(label)
+    return paths, np.array(labels, dtype=np.int64), classes
+
+
+def shardPath(root, shardRoot, directory):
+    """@shardPath
+
+    :return: directory holding shards of split directory, None if directory is not inside root.
+    """
+    relative = os.path.relpath(os.path.abspath(directory), os.path.abspath(root))
+    if relative.startswith(os.pardir):
+        return None
+    return os.path.join(shardRoot, relative)
+
+
+def _decode(path, size):
+    with Image.open(path) as image:
+        image = image.convert('RGB').resize((size[1], size[0]), Image.NEAREST)
+        return np.asarray(image, dtype=np.uint8)
+
+
+def compileSplit(directory, outDir, size=(224, 224), shardImages=1024, workers=None):
+    """@compileSplit
+
+    Decodes and resizes every image of one split once and writes them as uint8 (n, height, width, 3)
+    .npy shards, with labels.npy and index.json listing classes, shards and source files.
+
+    @:param directory str: split directory with class subdirectories.
+    @:param outDir str: output directory, replaced contents.
+    @:param size tuple: (height, width) of stored images.
+    @:param shardImages int: images per shard file.
+    """
+    paths, labels, classes = listImages(directory)
+    os.makedirs(outDir, exist_ok=True)
+    for file in os.listdir(outDir):
+        if file.startswith('images_') and file.endswith('.npy'):
+            os.remove(os.path.join(outDir, file))
+
+    shards = []
+    with ThreadPoolExecutor(workers) as pool:
+        for start in range(0, len(paths), shardImages):
+            batch = paths[start:start + shardImages]
+            name = 'images_' + str(len(shards)).zfill(5) + '.npy'
+            shard = np.lib.format.open_memmap(os.path.join(outDir, name), mode='w+', dtype=np.uint8,
+                                              shape=(len(batch), size[0], size[1], 3))
+            for i, image in enumerate(pool.map(lambda p: _decode(p, size), batch)):
+                shard[i] = image
+            shard.flush()
+            del shard
+            shards.append({'file': name, 'count': len(batch)})
+
+    np.save(os.path.join(outDir, 'labels.npy'), labels)
+    index = {'version': FORMAT_VERSION,
+             'size': list(size),
+             'classes': classes,
+             'count': len(paths),
+             'shards': shards,
+             'files': [[path, os.path.getmtime(path)] for path in paths]}
+    with open(os.path.join(outDir, 'index.json'), 'w') as file:
+        json.dump(index, file)
+    print('Compiled', len(paths), 'images of', directory, 'into', len(shards), 'shards')
+
+
+def compileDataset(root, shardRoot, size=(224, 224), shardImages=1024):
+    """@compileDataset
+
+    Compiles the test split and every train subdirectory (proxy and per client) of root into shardRoot,
+    keeping the directory layout.
+    """
+    splits = [os.path.join(root, 'test')]
+    trainDir = os.path.join(root, 'train')
+    if os.path.isdir(trainDir):
+        splits += [os.path.join(trainDir, d) for d in sorted(os.listdir(trainDir))
+                   if os.path.isdir(os.path.join(trainDir, d))]
+    for split in splits:
+        if os.path.isdir(split):
+            compileSplit(split, shardPath(root, shardRoot, split), size, shardImages)
+
+
+class ShardedDataset:
+    """@ShardedDataset
+
+    Compiled split opened through memory maps. Contiguous reads inside one shard are views of the map,
+    no decoding or copying happens until the data is used.
+
+    @:param directory str: directory written by compileSplit.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'index.json'), 'r') as file:
+            self.__index = json.load(file)
+        if self.__index['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported shard format version ' + str(self.__index['version']))
+        self.__labels = np.load(os.path.join(directory, 'labels.npy'))
+        self.__shards = [np.load(os.path.join(directory, shard['file']), mmap_mode='r')
+                         for shard in self.__index['shards']]
+        self.__offsets = np.cumsum([0] + [shard['count'] for shard in self.__index['shards']])
+
+    def __len__(self):
+        return self.__index['count']
+
+    def getSize(self):
+        return tuple(self.__index['size'])
+
+    def getClasses(self):
+        return self.__index['classes']
+
+    def getLabels(self):
+        return self.__labels
+
+    def isCurrent(self, paths):
+        """@isCurrent
+
+        :return: True if shards were compiled from exactly these files and none changed since.
+        """
+        files = self.__index['files']
+        if len(files) != len(paths):
+            return False
+        return all(path == entry[0] and os.path.getmtime(path) == entry[1] for path, entry in zip(paths, files))
+
+    def read(self, start, stop):
+        """@read
+
+        :return: images start:stop, a view of the memory map when they lie in one shard.
+        """
+        first = int(np.searchsorted(self.__offsets, start, side='right')) - 1
+        last = int(np.searchsorted(self.__offsets, stop - 1, side='right')) - 1
+        if first == last:
+            offset = self.__offsets[first]
+            return self.__shards[first][start - offset:stop - offset]
+        parts = []
+        for i in range(first, last + 1):
+            offset = self.__offsets[i]
+            parts.append(self.__shards[i][max(start - offset, 0):min(stop - offset, len(self.__shards[i]))])
+        return np.concatenate(parts)
+
+    def take(self, rows):
+        """@take
+
+        :return: images of sorted row indexes rows, gathered shard by shard.
+        """
+        shard = np.searchsorted(self.__offsets, rows, side='right') - 1
+        parts = []
+        for i in np.unique(shard):
+            parts.append(self.__shards[i][rows[shard == i] - self.__offsets[i]])
+        return np.concatenate(parts)
+
+    def batches(self, batchSize, shuffle=False, seed=None):
+        """@batches
+
+        Generator of (images, labels) batches. Without shuffling batches are in index order.
+        """
+        n = len(self)
+        if not shuffle:
+            for start in range(0, n, batchSize):
+                stop = min(start + batchSize, n)
+                yield self.read(start, stop), self.__labels[start:stop]
+            return
+
+        order = np.random.default_rng(seed).permutation(n)
+        for start in range(0, n, batchSize):
+            # sorted rows keep reads sequential inside the memory map
+            rows = np.sort(order[start:start + batchSize])
+            yield self.take(rows), self.__labels[rows]
+
+
+if __name__ == '__main__':
+    from imgSrc import learnDir, __main as main
+
+    shardRoot = sys.argv[1] if len(sys.argv) > 1 else os.path.join(main, 'learning_dataset_shards')
+    compileDataset(learnDir, shardRoot)
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+
+
+class FeatureCache:
+    """@FeatureCache
+
+    On-disk cache of pooled backbone features for one net type. Features are appended as float32 rows
+    to a raw file that is read back through a memory map; index.json maps every image path to its row
+    and the mtime the features were computed for, so changed images are recomputed.
+
+    @:param cacheDir str: root directory of all feature caches.
+    @:param key str: net type and input size the features belong to.
+    @:param featureSize int: length of a feature vector.
+    """
+
+    def __init__(self, cacheDir, key, featureSize):
+        self.__dir = os.path.join(cacheDir, key)
+        self.__featureSize = featureSize
+        self.__dataPath = os.path.join(self.__dir, 'features.f32')
+        self.__indexPath = os.path.join(self.__dir, 'index.json')
+        self.__map = None
+
+        os.makedirs(self.__dir, exist_ok=True)
+        self.__index = {}
+        if os.path.exists(self.__indexPath):
+            with open(self.__indexPath, 'r') as file:
+                index = json.load(file)
+            if index['featureSize'] == featureSize:
+                self.__index = index['files']
+        if not self.__index and os.path.exists(self.__dataPath):
+            os.remove(self.__dataPath)
+
+    def getFeatureSize(self):
+        return self.__featureSize
+
+    def __rows(self):
+        if not os.path.exists(self.__dataPath):
+            return 0
+        return os.path.getsize(self.__dataPath) // (4 * self.__featureSize)
+
+    def missing(self, paths):
+        """@missing
+
+        :return: paths without features or whose file changed since they were computed.
+        """
+        result = []
+        for path in paths:
+            entry = self.__index.get(path)
+            if entry is None or entry[1] != os.path.getmtime(path):
+                result.append(path)
+        return result
+
+    def store(self, paths, features):
+        """@store
+
+        @:param paths list: image paths.
+        @:param features np.array: (len(paths), featureSize) features of these images.
+        """
+        features = np.ascontiguousarray(features, dtype=np.float32).reshape(len(paths), self.__featureSize)
+        row = self.__rows()
+        with open(self.__dataPath, 'ab') as file:
+            file.write(features.data)
+        for i, path in enumerate(paths):
+            self.__index[path] = [row + i, os.path.getmtime(path)]
+        self.__map = None
+        with open(self.__indexPath, 'w') as file:
+            json.dump({'featureSize': self.__featureSize, 'files': self.__index}, file)
+
+    def load(self, paths):
+        """@load
+
+        :return: (len(paths), featureSize) float32 array of cached features in order of paths.
+        """
+        if self.__map is None:
+            self.__map = np.memmap(self.__dataPath, dtype=np.float32, mode='r',
+                                   shape=(self.__rows(), self.__featureSize))
+        rows = np.fromiter((self.__index[path][0] for path in paths), dtype=np.int64, count=len(paths))
+        return self.__map[rows]
@@ -0,0 +1,250 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import weightDelta
+from aggregation import FedAvgAggregator
+from comunicationCodes import ComCodes
+
+
+class ClientResult:
+    """@ClientResult
+
+    Outcome of one command sent to one client: reply message, latency in seconds and error
+    (TimeoutError when the client missed its deadline).
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.sent = None
+        self.reply = None
+        self.latency = None
+        self.error = None
+
+    def ok(self):
+        return self.reply is not None and self.error is None
+
+    def getAccuracy(self):
+        if self.reply is not None and self.reply[0] == ComCodes.POST_ACCURACY:
+            return self.reply[1]
+        return None
+
+
+class RoundSummary:
+    """@RoundSummary
+
+    Results of a command broadcast to a set of clients.
+    """
+
+    def __init__(self, code, clients):
+        self.code = code
+        self.results = {client.getName(): ClientResult(client) for client in clients}
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def replied(self):
+        return [r for r in self.results.values() if r.ok()]
+
+    def timedOut(self):
+        return [r for r in self.results.values() if isinstance(r.error, TimeoutError)]
+
+    def failed(self):
+        return [r for r in self.results.values() if r.error is not None and not isinstance(r.error, TimeoutError)]
+
+    def accuracies(self):
+        return {name: r.getAccuracy() for name, r in self.results.items() if r.getAccuracy() is not None}
+
+    def toDict(self):
+        return {'code': self.code.name,
+                'duration': self.duration,
+                'clients': {name: {'ok': r.ok(),
+                                   'latency': r.latency,
+                                   'accuracy': r.getAccuracy(),
+                                   'error': None if r.error is None else repr(r.error)}
+                            for name, r in self.results.items()}}
+
+    def __str__(self):
+        return (self.code.name + ': ' + str(len(self.replied())) + '/' + str(len(self.results)) + ' replied, '
+                + str(len(self.timedOut())) + ' timed out, ' + str(len(self.failed())) + ' failed in '
+                + str(round(self.duration or 0, 3)) + ' s')
+
+
+class FederationController:
+    """@FederationController
+
+    Sends commands to many clients at once and collects their replies. Requests are queued on all
+    connections before waiting for any reply, so the clients work concurrently.
+    """
+
+    def __init__(self, clients=(), aggregator=None):
+        self.__clients = list(clients)
+        self.__aggregator = aggregator if aggregator is not None else FedAvgAggregator()
+        self.__globalWeights = None
+        self.__aggregating = False
+        self.__mutex = threading.Lock()
+
+    def getAggregator(self):
+        return self.__aggregator
+
+    def setAggregator(self, aggregator):
+        self.__aggregator = aggregator
+
+    def setGlobalWeights(self, weights):
+        """@setGlobalWeights
+
+        @:param weights list: weights clients started the round from; delta updates are applied to them.
+        """
+        self.__globalWeights = weights
+
+    def getClients(self):
+        return list(self.__clients)
+
+    def addClient(self, client):
+        self.__clients.append(client)
+
+    def broadcast(self, code, *args, clients=None):
+        """@broadcast
+
+        @:param code ComCodes: command sent to every client.
+        @:param clients list: PeerConnections to address, all clients if None.
+        :return: RoundSummary being filled and dict {client name: Future}.
+        """
+        if clients is None:
+            clients = self.__clients
+        summary = RoundSummary(code, clients)
+        futures = {}
+        for client in clients:
+            result = summary.results[client.getName()]
+            result.sent = time.perf_counter()
+            future = client.request(code, *args)
+            future.add_done_callback(lambda f, r=result: self.__recordLatency(f, r))
+            futures[client.getName()] = future
+        return summary, futures
+
+    def __recordLatency(self, future, result):
+        if not future.cancelled() and result.latency is None:
+            result.latency = time.perf_counter() - result.sent
+
+    def gather(self, summary, futures, timeout=None, onReply=None):
+        """@gather
+
+        Waits for replies as they arrive until every client answered or missed its deadline.
+        Requests of clients that missed the deadline are cancelled.
+
+        @:param timeout: seconds from the broadcast, a number for all clients or dict {client name: seconds};
+            None waits without limit.
+        @:param onReply: callable (client, reply) called in arrival order. An exception it raises is recorded
+            as the error of that client.
+        :return: summary
+        """
+        deadlines = {}
+        for name in futures:
+            limit = timeout.get(name) if isinstance(timeout, dict) else timeout
+            deadlines[name] = None if limit is None else summary.started + limit
+        names = {future: name for name, future in futures.items()}
+        pending = set(futures.values())
+
+        while pending:
+            now = time.perf_counter()
+            for future in list(pending):
+                deadline = deadlines[names[future]]
+                if deadline is not None and now >= deadline and future.cancel():
+                    summary.results[names[future]].error = TimeoutError('No reply within deadline')
+                    pending.discard(future)
+            if not pending:
+                break
+
+            remaining = [deadlines[names[f]] - now for f in pending if deadlines[names[f]] is not None]
+            done, pending = wait(pending, timeout=min(remaining) if remaining else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = summary.results[names[future]]
+                if future.cancelled():
+                    result.error = TimeoutError('Request cancelled')
+                elif future.exception() is not None:
+                    result.error = future.exception()
+                else:
+                    self.__recordLatency(future, result)
+                    result.reply = future.result()
+                    if onReply is not None:
+                        try:
+                            onReply(result.client, result.reply)
+                        except Exception as e:
+                            # a bad reply must not stop collecting the others
+                            print('Reply of', result.client.getName(), 'rejected:', e)
+                            result.error = e
+
+        summary.duration = time.perf_counter() - summary.started
+        return summary
+
+    def runCommand(self, code, *args, clients=None, timeout=None, onReply=None):
+        """@runCommand
+
+        Broadcasts code to clients and gathers the replies, see broadcast and gather.
+
+        :return: RoundSummary
+        """
+        summary, futures = self.broadcast(code, *args, clients=clients)
+        return self.gather(summary, futures, timeout, onReply)
+
+    def train(self, clients=None, timeout=None, onReply=None):
+        args = []
+        if hasattr(self.__aggregator, 'getTrainingArgs'):
+            args.append(self.__aggregator.getTrainingArgs())
+        return self.runCommand(ComCodes.RETRAIN_MODEL, *args, clients=clients, timeout=timeout, onReply=onReply)
+
+    def isAggregating(self):
+        return self.__aggregating
+
+    def beginAggregation(self):
+        """@beginAggregation
+
+        Starts accepting client updates. Anything folded before is discarded.
+        """
+        with self.__mutex:
+            self.__aggregator.reset()
+            self.__aggregating = True
+
+    def foldWeights(self, client, message):
+        """@foldWeights
+
+        Adds weights from a POST_WEIGHTS message or GET_WEIGHTS reply to the current aggregation.
+        The optional info dict at the end of the message may hold 'samples' and delta update fields.
+        Updates arriving while no aggregation is open (see beginAggregation) are ignored.
+        """
+        info = message[-1] if isinstance(message[-1], dict) else None
+        encoding = 'full' if info is None else info.get('encoding', 'full')
+        with self.__mutex:
+            if not self.__aggregating:
+                print('Update from', client.getName(), 'ignored, no aggregation in progress')
+                return
+            if encoding != 'full' and self.__globalWeights is None:
+                raise ValueError(client.getName() + ' sent a ' + str(encoding) + ' update but no global weights '
+                                 'are set to apply it to, see setGlobalWeights')
+            weights = weightDelta.applyUpdate(self.__globalWeights, message[1], info)
+            samples = 1.0 if info is None else info.get('samples', 1.0)
+            self.__aggregator.add(weights, samples)
+
+    def collectWeights(self, clients=None, timeout=None):
+        """@collectWeights
+
+        Requests weights from clients and folds every reply into the aggregation as it arrives.
+        Call beginAggregation first.
+
+        :return: RoundSummary
+        """
+        return self.runCommand(ComCodes.GET_WEIGHTS, {'base': None, 'topK': None}, clients=clients, timeout=timeout,
+                               onReply=self.foldWeights)
+
+    def finishAggregation(self, reopen=False):
+        """@finishAggregation
+
+        @:param reopen bool: keep accepting updates, they go to the next aggregation.
+        :return: aggregated weights (None if no update arrived); the aggregator is reset for the next round.
+        """
+        with self.__mutex:
+            result = self.__aggregator.result()
+            self.__aggregator.reset()
+            self.__aggregating = reopen
+        if result is not None:
+            self.__globalWeights = result
+        return result
@@ -0,0 +1,124 @@
+import pickle
+import struct
+from collections import namedtuple
+
+import payloadCodecs
+import tensorFormat
+from comunicationCodes import ComCodes
+
+# Fixed width, network byte order: payload length, ComCode, request id, flags.
+HEADER = struct.Struct('!QHIH')
+HEADER_SIZE = HEADER.size
+
+# low bits of flags hold the payloadCodecs id the payload is compressed with
+CODEC_MASK = 0x000F
+FLAG_TENSORS = 0x0010
+
+# largest payload accepted from the wire, checked before the payload buffer is allocated
+MAX_FRAME_SIZE = 2 ** 31
+
+FrameHeader = namedtuple('FrameHeader', ['length', 'code', 'requestId', 'flags'])
+
+
+def encodeMessage(message, requestId=0, transferMode='float32', codec=None):
+    """@encodeMessage
+
+    @:param message list: message in form [ComCodes, *args].
+    @:param requestId int: id used to correlate response with request.
+    @:param transferMode str: precision used for tensors, one of tensorFormat.TRANSFER_MODES.
+    @:param codec: payloadCodecs id or name, None to select one from payload type and size.
+    :return: list of buffers (header, payload...) ready to be sent.
+    """
+    flags = 0
+    if tensorFormat.hasTensors(message[1:]):
+        buffers, length = tensorFormat.encode(message[1:], transferMode)
+        flags |= FLAG_TENSORS
+    else:
+        buffers = [pickle.dumps(message)]
+        length = len(buffers[0])
+
+    if codec is None:
+        codec = payloadCodecs.selectCodec(length, flags & FLAG_TENSORS, transferMode)
+    codec = payloadCodecs.getCodec(codec).id
+    if codec != payloadCodecs.NONE:
+        buffers = payloadCodecs.compress(codec, buffers)
+        length = len(buffers[0])
+
+    header = HEADER.pack(length, message[0].value, requestId, flags | codec)
+    return [header] + buffers
+
+
+def decodeHeader(buffer):
+    return FrameHeader(*HEADER.unpack(buffer))
+
+
+def decodeMessage(header, payload):
+    """@decodeMessage
+
+    @:param header FrameHeader: decoded frame header.
+    @:param payload bytearray: exactly header.length bytes of payload.
+    :return: message in form [ComCodes, *args].
+    """
+    payload = payloadCodecs.decompress(header.flags & CODEC_MASK, payload)
+    if header.flags & FLAG_TENSORS:
+        return [ComCodes(header.code)] + tensorFormat.decode(payload)
+    message = pickle.loads(payload)
+    if message[0] != ComCodes(header.code):
+        raise ValueError('Frame header code ' + str(header.code) + ' does not match message ' + str(message[0]))
+    return message
+
+
+class FrameReader:
+    """@FrameReader
+
+    Incremental frame reader for non-blocking sockets. Header and payload are read with recv_into
+    straight into preallocated buffers, so a frame is never assembled by concatenation. Frames longer
+    than MAX_FRAME_SIZE raise ConnectionError, the stream cannot be resynchronized after them.
+    """
+
+    def __init__(self):
+        self.__headerBuffer = bytearray(HEADER_SIZE)
+        self.__reset()
+
+    def __reset(self):
+        self.__header = None
+        self.__buffer = self.__headerBuffer
+        self.__view = memoryview(self.__buffer)
+        self.__received = 0
+
+    def __bufferFilled(self, frames):
+        if self.__header is None:
+            self.__header = decodeHeader(self.__buffer)
+            if self.__header.length > MAX_FRAME_SIZE:
+                raise ConnectionError('Frame of ' + str(self.__header.length) + ' bytes exceeds the limit of '
+                                      + str(MAX_FRAME_SIZE) + ' bytes')
+            self.__buffer = bytearray(self.__header.length)
+            self.__view = memoryview(self.__buffer)
+            self.__received = 0
+            if self.__header.length > 0:
+                return
+        frames.append((self.__header, self.__buffer))
+        self.__reset()
+
+    def readFrom(self, sock):
+        """@readFrom
+
+        Reads everything currently available on the socket.
+
+        @:param sock socket: connected non-blocking socket.
+        :return: list of complete (FrameHeader, payload) tuples, possibly empty.
+        """
+        frames = []
+        while True:
+            try:
+                n = sock.recv_into(self.__view[self.__received:])
+            except (BlockingIOError, InterruptedError):
+                return frames
+            if n == 0:
+                if frames:
+                    # closing is reported on the next read, after these frames are handled
+                    return frames
+                raise ConnectionError('Connection closed by peer')
+            self.__received += n
+            if self.__received == len(self.__buffer):
+                self.__bufferFilled(frames)
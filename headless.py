@@ -0,0 +1,229 @@
+import json
+import os
+import sys
+import time
+import traceback
+
+import numpy as np
+
+import utils
+from aggregation import createAggregator
+from ClientConnection import ClientConnection
+from ServerConnection import ServerConnection
+from comunicationCodes import ComCodes
+from connectionManager import ConnectionManager
+from federation import FederationController
+from roundScheduler import RoundScheduler, WeightDistributor
+
+# Campaign file, every key is optional:
+#
+#     {"net": "vgg", "rounds": 3, "scheduled": false, "roundTimeout": 600, "roundQuorum": null,
+#      "aggregator": "fedavg", "download": true, "evaluate": true, "timeout": 600,
+#      "host": "localhost", "serverPort": 5000, "clients": 10, "firstPort": 6000,
+#      "transferMode": "float32", "codec": "auto", "updateTopK": null, "testDir": null, "minReplies": 1,
+#      "config": "../config.txt", "output": "results.json"}
+#
+# Missing connection settings are read from the config file like the GUI does. roundTimeout defaults to
+# timeout, testDir to the test split of the learning dataset. A round fails when fewer than minReplies
+# clients answer its training or weights request.
+
+DEFAULTS = {'rounds': 1, 'scheduled': False, 'roundTimeout': None, 'roundQuorum': None, 'aggregator': 'fedavg',
+            'download': True, 'evaluate': True, 'timeout': 600.0, 'host': 'localhost', 'testDir': None, 'minReplies': 1,
+            'config': os.path.join(os.pardir, 'config.txt'), 'output': 'results.json'}
+
+
+def loadCampaign(path):
+    with open(path, 'r') as file:
+        campaign = dict(DEFAULTS, **json.load(file))
+    readers = {'serverPort': utils.getServerPort, 'clients': utils.getClientsNumber,
+               'firstPort': utils.getTesterPort, 'transferMode': utils.getTransferMode,
+               'codec': utils.getCodec, 'updateTopK': utils.getUpdateTopK}
+    for key, reader in readers.items():
+        if key not in campaign:
+            campaign[key] = reader(campaign['config'])
+    if campaign['roundTimeout'] is None:
+        campaign['roundTimeout'] = campaign['timeout']
+    if campaign['codec'] == 'auto':
+        campaign['codec'] = None
+    return campaign
+
+
+def toJson(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError('Object of type ' + type(obj).__name__ + ' is not JSON serializable')
+
+
+class HeadlessController:
+    """@HeadlessController
+
+    Runs a scripted campaign without a display: set net, training rounds, model download and evaluation.
+    Uses the same connection classes and model as the GUI and records the duration of every phase.
+
+    @:param campaign dict: campaign settings, see loadCampaign.
+    """
+
+    def __init__(self, campaign):
+        from convNet1 import convModel
+
+        self.__campaign = campaign
+        self.__model = convModel()
+        if campaign['testDir'] is not None:
+            self.__model.setTestPath(campaign['testDir'])
+        self.__connections = ConnectionManager()
+        self.__server = ServerConnection(campaign['host'], campaign['serverPort'], campaign['serverPort'] + 1)
+        self.__server.addModelRef(self.__model)
+        self.__server.setUpdateTopK(campaign['updateTopK'])
+
+        firstPort = campaign['firstPort']
+        self.__clients = [ClientConnection('client-' + str(i), firstPort + i * 2, firstPort + i * 2 + 1)
+                          for i in range(campaign['clients'])]
+        self.__federation = FederationController(self.__clients, createAggregator(campaign['aggregator']))
+        self.__distributor = WeightDistributor(campaign['updateTopK'])
+        self.__weights = None
+        for client in self.__clients:
+            client.setWeightsHandler(self.__federation.foldWeights)
+            self.__connections.register(client)
+        self.__connections.register(self.__server)
+
+        self.__results = {'campaign': campaign, 'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'phases': [], 'rounds': [], 'evaluation': None}
+
+    def __phase(self, name, fn):
+        """@__phase
+
+        Runs fn and records its duration. :return: True if fn succeeded.
+        """
+        print('Phase', name)
+        phase = {'name': name, 'duration': None, 'ok': False, 'error': None}
+        self.__results['phases'].append(phase)
+        start = time.perf_counter()
+        try:
+            details = fn()
+            phase['ok'] = True
+            if details is not None:
+                phase['details'] = details
+        except Exception as e:
+            traceback.print_exc()
+            phase['error'] = repr(e)
+        phase['duration'] = time.perf_counter() - start
+        print('Phase', name, 'finished in', round(phase['duration'], 3), 's')
+        return phase['ok']
+
+    def __setUp(self):
+        connections = [self.__server] + self.__clients
+        for connection in connections:
+            connection.setCodec(self.__campaign['codec'])
+        self.__connections.start()
+
+        deadline = time.perf_counter() + self.__campaign['timeout']
+        failed = []
+        for connection in connections:
+            try:
+                if not connection.waitConnected(max(deadline - time.perf_counter(), 0)):
+                    failed.append(connection.getName() + ' did not connect in time')
+            except ConnectionError as e:
+                failed.append(str(e))
+        if failed:
+            raise ConnectionError('; '.join(failed))
+
+        mode = self.__campaign['transferMode']
+        if mode != 'float32':
+            for connection in connections:
+                connection.requestTransferMode(mode)
+        return {'peers': len(connections)}
+
+    def __setNet(self):
+        reply = self.__server.request(ComCodes.LOAD_MODEL, self.__campaign['net']).result(self.__campaign['timeout'])
+        self.__server.handleMessage(None, reply)
+        return {'reply': reply[1:]}
+
+    def __runRound(self, number):
+        timeout = self.__campaign['roundTimeout']
+        # clients start from the aggregate of the previous round, like in scheduled rounds
+        received = set()
+        if self.__weights is not None:
+            received = self.__distributor.send(self.__clients, number, self.__weights)
+        train = self.__federation.train(timeout=timeout, onReply=lambda client, reply: client.handleReply(reply))
+        for name, result in train.results.items():
+            if not result.ok():
+                self.__distributor.acknowledge(name, None)
+            elif name in received:
+                self.__distributor.acknowledge(name, number)
+
+        self.__federation.beginAggregation()
+        collect = self.__federation.collectWeights(timeout=timeout)
+        weights = self.__federation.finishAggregation()
+        if weights is not None:
+            self.__weights = weights
+        self.__results['rounds'].append({'round': number, 'distributed': len(received), 'train': train.toDict(),
+                                         'collect': collect.toDict(), 'aggregated': weights is not None})
+        print(train)
+        print(collect)
+        for summary in (train, collect):
+            if len(summary.replied()) < self.__campaign['minReplies']:
+                raise RuntimeError('Round ' + str(number) + ' ' + str(summary))
+
+    def __runScheduled(self):
+        scheduler = RoundScheduler(self.__federation, self.__campaign['roundTimeout'], self.__campaign['roundQuorum'],
+                                   rounds=self.__campaign['rounds'], topK=self.__campaign['updateTopK'])
+        scheduler.start()
+        scheduler.join()
+        self.__results['rounds'] = [report.toDict() for report in scheduler.getReports()]
+        return {'clients': {name: stats.toDict() for name, stats in scheduler.getStats().items()}}
+
+    def __download(self):
+        self.__server.downloadModel().result(self.__campaign['timeout'])
+        return {'modelType': self.__model.getModelType()}
+
+    def __evaluate(self):
+        evaluation = self.__model.evaluateFull()
+        self.__results['evaluation'] = {key: evaluation[key] for key in
+                                        ('loss', 'accuracy', 'confusionMatrix', 'precision', 'recall', 'classes')}
+
+    def run(self):
+        """@run
+
+        Runs the campaign phases in order, stopping at the first failed phase.
+
+        :return: results dict, also written to the campaign output file.
+        """
+        campaign = self.__campaign
+        phases = [('connect', self.__setUp)]
+        if campaign.get('net') is not None:
+            phases.append(('setNet', self.__setNet))
+        if campaign['scheduled']:
+            phases.append(('rounds', self.__runScheduled))
+        else:
+            for number in range(1, campaign['rounds'] + 1):
+                phases.append(('round ' + str(number), lambda n=number: self.__runRound(n)))
+        if campaign['download']:
+            phases.append(('download', self.__download))
+        if campaign['evaluate']:
+            phases.append(('evaluate', self.__evaluate))
+
+        start = time.perf_counter()
+        try:
+            for name, fn in phases:
+                if not self.__phase(name, fn):
+                    break
+        finally:
+            self.__results['duration'] = time.perf_counter() - start
+            self.__connections.stop()
+            with open(campaign['output'], 'w') as file:
+                json.dump(self.__results, file, indent=2, default=toJson)
+            print('Results written to', campaign['output'])
+        return self.__results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python headless.py campaign.json [results.json]')
+        sys.exit(2)
+    settings = loadCampaign(sys.argv[1])
+    if len(sys.argv) > 2:
+        settings['output'] = sys.argv[2]
+    results = HeadlessController(settings).run()
+    sys.exit(0 if all(phase['ok'] for phase in results['phases']) else 1)
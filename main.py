@@ -1,4 +1,5 @@
 import sys
+import threading
 import time
 
 from PyQt5.QtWidgets import QApplication
@@ -6,20 +7,47 @@ from PyQt5.QtWidgets import QGridLayout, QHBoxLayout, QVBoxLayout
 from PyQt5.QtWidgets import QPushButton
 from PyQt5.QtWidgets import QComboBox
 from PyQt5.QtWidgets import QMainWindow, QWidget, QFrame, QLabel, QFileDialog, QDialog
+from PyQt5.QtWidgets import QTableView, QHeaderView, QAbstractItemView
 from PyQt5.QtGui import QPixmap
 from PyQt5 import QtGui
-from PyQt5.QtCore import Qt, QBuffer
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal, pyqtSlot
 
-from utils import readNetTypes, getClientsNumber, getTesterPort, getServerPort
+from utils import readNetTypes, getClientsNumber, getTesterPort, getServerPort, getTransferMode, \
+    getUpdateTopK, getCodec, getRoundTimeout, getRoundQuorum, getModelCacheBudget
 from ClientConnection import ClientConnection
 from ServerConnection import ServerConnection
+from connectionManager import ConnectionManager
+from federation import FederationController
+from roundScheduler import RoundScheduler
 from comunicationCodes import ComCodes
 from convNet1 import convModel
-from PIL import Image
-import io
+from modelWorker import ModelWorker, HIGH
+import uiEvents
+from uiEvents import UiEventBus
+from clientState import ClientStateStore
+from clientTable import ClientTableModel
 import numpy as np
 
 
+class GuiDispatcher(QObject):
+    """@GuiDispatcher
+
+    Runs callables handed over from other threads on the GUI thread through a queued Qt signal.
+    """
+    called = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.called.connect(self.__run)
+
+    @pyqtSlot(object)
+    def __run(self, fn):
+        fn()
+
+    def deliver(self, fn):
+        self.called.emit(fn)
+
+
 class MainApp(QMainWindow):
     def __init__(self, nets=[]):
         super().__init__()
@@ -30,7 +58,10 @@ class MainApp(QMainWindow):
         self.imgTrueClassLabel = QLabel()
         self.imgPredictedClassLabel = QLabel()
 
-        self.model = convModel()
+        self.model = convModel(modelCacheBudget=getModelCacheBudget())
+        self.dispatcher = GuiDispatcher()
+        self.worker = ModelWorker(self.dispatcher.deliver)
+        self.worker.start()
         self.nets = nets
 
         host = 'localhost'
@@ -38,16 +69,30 @@ class MainApp(QMainWindow):
         self.clientsInNet = getClientsNumber()
         self.firstPort = getTesterPort()
 
+        # connection and worker threads post status changes here, the GUI thread applies them on a timer
+        self.events = UiEventBus()
+        self.connections = ConnectionManager()
         self.serverConnection = ServerConnection(host, serverPort, serverPort + 1)
+        self.serverConnection.setEventBus(self.events)
 
         self.clients = []
         self.accBtns = []
         for i in range(self.clientsInNet):
             self.clients.append(ClientConnection('client-' + str(i), self.firstPort + (i * 2),
-                                                 self.firstPort + (i * 2) + 1, self))
+                                                 self.firstPort + (i * 2) + 1, self.events))
+        self.clientStore = ClientStateStore([c.getName() for c in self.clients],
+                                            [c.getConnectionDetails() for c in self.clients])
+        self.clientTableModel = ClientTableModel(self.clientStore)
+        self.uiTicks = 0
 
         for client in self.clients:
-            client.start()
+            self.connections.register(client)
+        self.federation = FederationController(self.clients)
+        for client in self.clients:
+            client.setWeightsHandler(self.federation.foldWeights)
+        self.roundTimeout = getRoundTimeout()
+        self.roundQuorum = getRoundQuorum()
+        self.scheduler = None
 
         self.setWindowTitle('Federated learning controller')
 
@@ -69,16 +114,58 @@ class MainApp(QMainWindow):
         self.addTrainButton()
         self.addPredictImage()
 
-        self.serverConnection.addQtControls(self.preTrainVal, self.postTrainVal, self.trainBtn, self.netBtn,
-                                                self.accBtns, self.downloadBtn, self.currentModel, self.modelDownloadedAcc)
+        self.__addEventHandlers()
         self.serverConnection.addModelRef(self.model)
-        self.serverConnection.setCallbacks(self.imageIsSet, lambda: self.predictChangeState(True))
-        self.serverConnection.start()
+        self.serverConnection.setWorker(self.worker)
+        self.serverConnection.setUpdateTopK(getUpdateTopK())
+        self.connections.register(self.serverConnection)
+        self.connections.start()
+
+        codec = getCodec()
+        self.serverConnection.setCodec(codec)
+        for client in self.clients:
+            client.setCodec(codec)
+
+        transferMode = getTransferMode()
+        if transferMode != 'float32':
+            for connection in [self.serverConnection] + self.clients:
+                try:
+                    connection.requestTransferMode(transferMode)
+                except ConnectionError as e:
+                    print('Cannot set transfer mode:', e)
 
         self.disableButtons()
 
         self.show()
 
+    def __addEventHandlers(self):
+        self.events.setHandler(uiEvents.CLIENT_ACCURACY, self.clientStore.setAccuracy)
+        self.events.setHandler(uiEvents.CLIENT_STATUS, self.clientStore.setParticipation)
+        self.events.setHandler(uiEvents.SERVER_ACCURACY, self.__showServerAccuracy)
+        self.events.setHandler(uiEvents.CONTROLS_ENABLED,
+                               lambda _, enabled: self.enableButtons() if enabled else self.disableButtons())
+        self.events.setHandler(uiEvents.MODEL_TYPE, lambda _, modelType: self.currentModel.setText(modelType))
+        self.events.setHandler(uiEvents.MODEL_ACCURACY, lambda _, accuracy: self.modelDownloadedAcc.setText(accuracy))
+        self.events.setHandler(uiEvents.PREDICT_ENABLED,
+                               lambda _, enabled: self.predictChangeState(enabled and self.imageIsSet()))
+
+        # at most 20 redraws per second, however many events arrive; traffic columns refresh twice a second
+        self.eventTimer = QTimer(self)
+        self.eventTimer.timeout.connect(self.__refreshUi)
+        self.eventTimer.start(50)
+
+    def __refreshUi(self):
+        self.events.dispatch()
+        self.uiTicks += 1
+        if self.uiTicks % 10 == 0:
+            self.clientStore.updateTraffic([client.getTraffic() for client in self.clients],
+                                           [client.getLastLatency() for client in self.clients])
+        self.clientTableModel.refresh()
+
+    def __showServerAccuracy(self, _, accuracy):
+        self.preTrainVal.setText(accuracy[0])
+        self.postTrainVal.setText(accuracy[1])
+
     def addClientInfo(self):
         clientWidget = QWidget()
         clientLayout = QVBoxLayout()
@@ -93,8 +180,28 @@ class MainApp(QMainWindow):
 
         clientLayout.addWidget(clientsInNet)
 
-        for client in self.clients:
-            clientLayout.addWidget(self.__addClientPanel(client))
+        self.clientTable = QTableView()
+        self.clientTable.setModel(self.clientTableModel)
+        self.clientTable.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.clientTable.verticalHeader().setVisible(False)
+        # fixed row heights keep the view from measuring every row
+        self.clientTable.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.clientTable.verticalHeader().setDefaultSectionSize(22)
+        self.clientTable.horizontalHeader().setStretchLastSection(True)
+        clientLayout.addWidget(self.clientTable)
+
+        def updateSelected():
+            for index in self.clientTable.selectionModel().selectedRows():
+                try:
+                    self.clients[index.row()].send([ComCodes.GET_ACCURACY])
+                except ConnectionError as e:
+                    print('Cannot update client:', e)
+
+        updateBtn = QPushButton('Update selected')
+        updateBtn.setFixedWidth(100)
+        updateBtn.clicked.connect(updateSelected)
+        clientLayout.addWidget(updateBtn)
+        self.accBtns.append(updateBtn)
 
         self.layout.addWidget(clientWidget, 1, 0)
 
@@ -117,12 +224,33 @@ class MainApp(QMainWindow):
         trainDetLayout.addWidget(postLabel)
         trainDetLayout.addWidget(self.postTrainVal)
 
+        def runRound():
+            summary = self.federation.train(timeout=self.roundTimeout,
+                                            onReply=lambda client, reply: client.handleReply(reply))
+            print(summary)
+            if len(summary.replied()) < len(summary.results):
+                # the server does not report accuracy for an incomplete round
+                self.events.post(uiEvents.CONTROLS_ENABLED, value=True)
+
         def handleTrain():
             self.disableButtons()
             for client in self.clients:
                 client.setServerStatusText('-')
                 client.setAccuracyText('-')
-                client.send([ComCodes.RETRAIN_MODEL])
+            threading.Thread(target=runRound, daemon=True).start()
+
+        def handleRounds():
+            if self.scheduler is not None and self.scheduler.is_alive():
+                self.scheduler.stop()
+                self.roundsBtn.setText('Run rounds')
+                return
+            # aggregated weights go through the model worker like every other model change
+            self.scheduler = RoundScheduler(self.federation, self.roundTimeout, self.roundQuorum,
+                                            onAggregated=lambda weights: self.worker.submit(
+                                                self.model.setTrainableWeights, weights),
+                                            topK=getUpdateTopK())
+            self.scheduler.start()
+            self.roundsBtn.setText('Stop rounds')
 
         ########################################################### Add click event! Done
         btnWidget = QWidget()
@@ -133,6 +261,10 @@ class MainApp(QMainWindow):
         self.trainBtn.setFixedWidth(100)
         self.trainBtn.clicked.connect(handleTrain)
         btnLayout.addWidget(self.trainBtn)
+        self.roundsBtn = QPushButton('Run rounds')
+        self.roundsBtn.setFixedWidth(100)
+        self.roundsBtn.clicked.connect(handleRounds)
+        btnLayout.addWidget(self.roundsBtn)
 
         trainLayout.addWidget(QLabel('Accuracy:'))
         trainLayout.addWidget(trainingDetailsWidget)
@@ -158,10 +290,22 @@ class MainApp(QMainWindow):
         resultLayout.addWidget(predictedClass)
         resultLayout.addWidget(self.imgPredictedClassLabel)
 
+        def showPrediction(job):
+            # a cancelled job was replaced by a newer prediction, which updates the label
+            if job.cancelled():
+                return
+            if job.exception() is not None:
+                self.imgPredictedClassLabel.setText('-')
+                self.imgPredictedClassLabel.setToolTip('Prediction failed: ' + str(job.exception()))
+                return
+            self.imgPredictedClassLabel.setToolTip('')
+            self.imgPredictedClassLabel.setText(job.result())
+
         def predict():
-            im = self.pixmapToPIL()
-            prediction = self.model.predict(im)
-            self.imgPredictedClassLabel.setText(prediction)
+            self.imgPredictedClassLabel.setText('...')
+            # the original file is predicted, not the scaled pixmap; a newer prediction replaces a waiting one
+            self.worker.submit(self.model.predictFile, self.imgToPredict, priority=HIGH, key='predict',
+                               onDone=showPrediction)
 
         btnWidget = QWidget()
         btnWidget.setFixedWidth(255)
@@ -203,7 +347,7 @@ class MainApp(QMainWindow):
         modelDetailsLayout.addWidget(self.modelDownloadedAcc)
 
         def download():
-            self.serverConnection.send([ComCodes.GET_STRUCTURE])
+            self.serverConnection.downloadModel()
 
         ################################################################ Add event!
         self.downloadBtn = QPushButton('Download')
@@ -219,56 +363,6 @@ class MainApp(QMainWindow):
 
         return downloadWidget
 
-    def __addClientPanel(self, conn):
-
-        panel = QWidget()
-        panelLayout = QVBoxLayout()
-        panelLayout.setContentsMargins(0, 5, 0, 0)
-        panelLayout.setAlignment(Qt.AlignTop)
-        panel.setLayout(panelLayout)
-
-        nameWidget = QWidget()
-        nameLayout = QHBoxLayout()
-        nameWidget.setLayout(nameLayout)
-        nameLayout.setContentsMargins(0, 0, 0, 0)
-        nameLayout.setAlignment(Qt.AlignTop)
-
-        name = QLabel(conn.getName())
-        server = QLabel('Server:')
-        self.serverStatus = QLabel('-')
-        nameLayout.addWidget(name)
-        nameLayout.addWidget(server)
-        nameLayout.addWidget(self.serverStatus)
-
-        connection = QLabel('Connection: ' + conn.getConnectionDetails())
-
-        accWidget = QWidget()
-        accLayout = QHBoxLayout()
-        accLayout.setContentsMargins(0, 0, 0, 0)
-        accWidget.setLayout(accLayout)
-
-        accuracy = QLabel('Accuracy: -')
-        accLayout.addWidget(accuracy)
-
-        conn.setQLabels(accuracy, self.serverStatus)
-
-        getAccBtn = QPushButton('Update model')
-        getAccBtn.setFixedWidth(100)
-        getAccBtn.clicked.connect(lambda: conn.send([ComCodes.GET_ACCURACY]))
-        accLayout.addWidget(getAccBtn)
-        self.accBtns.append(getAccBtn)
-
-        bottomLine = QFrame()
-        bottomLine.setFixedHeight(1)
-        bottomLine.setFrameStyle(1)
-
-        panelLayout.addWidget(nameWidget)
-        panelLayout.addWidget(connection)
-        panelLayout.addWidget(accWidget)
-        panelLayout.addWidget(bottomLine)
-
-        return panel
-
     def __addDropdown(self, options):
         netSelect = QWidget()
         dropdownLayout = QHBoxLayout()
@@ -289,7 +383,11 @@ class MainApp(QMainWindow):
         def handleSetNet(net):
             self.disableButtons()
             print('sending')
-            self.serverConnection.send([ComCodes.LOAD_MODEL, net])
+            try:
+                self.serverConnection.send([ComCodes.LOAD_MODEL, net])
+            except ConnectionError as e:
+                print('Cannot set net:', e)
+                self.enableButtons()
 
         ############################################################# Add click event!
         self.netBtn = QPushButton("Set/ Reset Net")
@@ -359,20 +457,11 @@ class MainApp(QMainWindow):
             self.image.setText('No image selected.')
             self.image.setAlignment(Qt.AlignCenter)
 
-    def pixmapToPIL(self):
-        pmap = self.image.pixmap()
-        imageBuffer = QBuffer()
-        imageBuffer.open(QBuffer.ReadWrite)
-        pmap.save(imageBuffer, "PNG")
-        img = Image.open(io.BytesIO(imageBuffer.data()))
-        return img
-
     def loadImg(self):
         img = QFileDialog.getOpenFileName(self, 'Open File', r'C:\Users\Pawel\Studia\inz\COVID-19 Radiography Database',
                                           'Image files (*.png *.jpg)')
         self.imgToPredict = img[0]
-        if self.currentModel != '-':
-            self.predictChangeState(True)
+        self.predictChangeState(self.imageIsSet() and self.currentModel.text() != '-')
         self.__showImage()
 
     def __clearImage(self):
@@ -381,12 +470,20 @@ class MainApp(QMainWindow):
         self.__showImage()
 
     def imageIsSet(self):
-        return self.imgToPredict is not None
+        # a cancelled file dialog leaves an empty path
+        return bool(self.imgToPredict)
 
     def disableUpdateBtns(self):
         for btn in self.accBtns:
             btn.setEnabled(False)
 
+    def enableButtons(self):
+        for btn in self.accBtns:
+            btn.setEnabled(True)
+        self.trainBtn.setEnabled(True)
+        self.netBtn.setEnabled(True)
+        self.downloadBtn.setEnabled(True)
+
     def disableButtons(self):
         self.disableUpdateBtns()
         self.trainBtn.setEnabled(False)
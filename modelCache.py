@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+
+def modelBytes(model):
+    """@modelBytes
+
+    :return: memory taken by the variables of a keras model in bytes.
+    """
+    return sum(w.shape.num_elements() * w.dtype.size for w in model.weights)
+
+
+class ModelCache:
+    """@ModelCache
+
+    Least recently used cache of built models. Entries are evicted oldest first once their total size
+    exceeds the budget; the most recently added entry is always kept.
+
+    @:param budget int: memory budget in bytes.
+    """
+
+    def __init__(self, budget):
+        self.__budget = budget
+        self.__entries = OrderedDict()
+        self.__size = 0
+
+    def getBudget(self):
+        return self.__budget
+
+    def setBudget(self, budget):
+        self.__budget = budget
+        self.__evict()
+
+    def getSize(self):
+        return self.__size
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, key):
+        """@get
+
+        :return: value cached under key, marked as most recently used, None if not cached.
+        """
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        self.__entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size):
+        """@put
+
+        @:param size int: memory taken by value in bytes, see modelBytes.
+        """
+        if key in self.__entries:
+            self.__size -= self.__entries.pop(key)[1]
+        self.__entries[key] = (value, size)
+        self.__size += size
+        self.__evict()
+
+    def __evict(self):
+        while self.__size > self.__budget and len(self.__entries) > 1:
+            key, (_, size) = self.__entries.popitem(last=False)
+            self.__size -= size
+            print('Model cache: evicted', key)
+
+    def clear(self):
+        self.__entries.clear()
+        self.__size = 0
@@ -0,0 +1,102 @@
+import heapq
+import threading
+from concurrent.futures import Future
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+
+class ModelJob(Future):
+    """@ModelJob
+
+    Future of one call run by the ModelWorker. A job can be cancelled until it starts.
+    """
+
+    def __init__(self, fn, args, priority, key):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.key = key
+
+
+class ModelWorker(threading.Thread):
+    """@ModelWorker
+
+    Runs model operations (structure changes, weight updates, predictions) one at a time on its own thread,
+    so neither the GUI nor the connection loop waits for TensorFlow. Jobs run by priority, then in submit order.
+    Submitting a job with the key of a job still waiting cancels the waiting one.
+
+    @:param deliver: callable (fn) running fn on the thread that consumes results, e.g. through a Qt signal.
+        onDone callbacks are passed through it. None calls them on the worker thread.
+    """
+
+    def __init__(self, deliver=None):
+        super().__init__(name='model-worker', daemon=True)
+        self.__deliver = deliver
+        self.__condition = threading.Condition()
+        self.__queue = []
+        self.__sequence = 0
+        self.__waiting = {}
+        self.__running = True
+
+    def submit(self, fn, *args, priority=NORMAL, key=None, onDone=None):
+        """@submit
+
+        @:param fn: callable run with args on the worker thread.
+        @:param priority int: HIGH, NORMAL or LOW.
+        @:param key: jobs with the same key supersede each other while waiting, None never supersedes.
+        @:param onDone: callable (job) delivered once the job finished, failed or was cancelled.
+        :return: ModelJob
+        """
+        job = ModelJob(fn, args, priority, key)
+        if onDone is not None:
+            job.add_done_callback(lambda j: self.deliver(lambda: onDone(j)))
+        with self.__condition:
+            if key is not None:
+                previous = self.__waiting.get(key)
+                if previous is not None:
+                    previous.cancel()
+                self.__waiting[key] = job
+            heapq.heappush(self.__queue, (priority, self.__sequence, job))
+            self.__sequence += 1
+            self.__condition.notify()
+        return job
+
+    def deliver(self, fn):
+        if self.__deliver is None:
+            fn()
+        else:
+            self.__deliver(fn)
+
+    def pending(self):
+        with self.__condition:
+            return sum(1 for _, _, job in self.__queue if not job.cancelled())
+
+    def stop(self):
+        with self.__condition:
+            self.__running = False
+            for _, _, job in self.__queue:
+                job.cancel()
+            self.__queue = []
+            self.__condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.__condition:
+                while self.__running and not self.__queue:
+                    self.__condition.wait()
+                if not self.__running:
+                    return
+                _, _, job = heapq.heappop(self.__queue)
+                if job.key is not None and self.__waiting.get(job.key) is job:
+                    del self.__waiting[job.key]
+
+            if not job.set_running_or_notify_cancel():
+                continue
+            try:
+                job.set_result(job.fn(*job.args))
+            except Exception as e:
+                print('Model job', getattr(job.fn, '__name__', job.fn), 'failed:', e)
+                job.set_exception(e)
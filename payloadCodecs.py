@@ -0,0 +1,129 @@
+import bz2
+import lzma
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+# Codec id is stored in the low bits of the frame header flags (framing.CODEC_MASK).
+NONE = 0
+ZLIB_1 = 1
+ZLIB_4 = 2
+ZLIB_9 = 3
+LZMA = 4
+BZ2 = 5
+SHUFFLE_ZLIB = 6
+
+# Messages smaller than this are sent uncompressed, compression would cost more than it saves.
+SMALL_PAYLOAD = 4096
+# Element size used by byte shuffle; tensor buffers are float32 unless a quantized transfer mode is used.
+SHUFFLE_ITEMSIZE = 4
+
+Codec = namedtuple('Codec', ['id', 'name', 'compress', 'decompress'])
+
+__codecs = {}
+
+
+def register(codecId, name, compress, decompress):
+    """@register
+
+    @:param codecId int: id sent in the frame header, 0-15.
+    @:param name str: name used in configuration and benchmarks.
+    @:param compress: function bytes-like -> bytes-like.
+    @:param decompress: function bytes-like -> bytes-like.
+    """
+    if codecId in __codecs:
+        raise ValueError('Codec id ' + str(codecId) + ' is already registered as ' + __codecs[codecId].name)
+    __codecs[codecId] = Codec(codecId, name, compress, decompress)
+
+
+def getCodec(codec):
+    """@getCodec
+
+    @:param codec: codec id or name.
+    :return: Codec
+    """
+    if isinstance(codec, str):
+        for c in __codecs.values():
+            if c.name == codec:
+                return c
+        raise ValueError('Unknown codec ' + codec + ', expected one of ' + str(getCodecNames()))
+    if codec not in __codecs:
+        raise ValueError('Unknown codec id ' + str(codec))
+    return __codecs[codec]
+
+
+def getCodecNames():
+    return [c.name for c in __codecs.values()]
+
+
+def shuffle(data, itemsize=SHUFFLE_ITEMSIZE):
+    """@shuffle
+
+    Groups byte i of every element together, which makes float data far more compressible.
+    Trailing bytes that do not form a whole element are left in place.
+    """
+    data = np.frombuffer(data, np.uint8)
+    n = len(data) - len(data) % itemsize
+    result = np.empty_like(data)
+    result[:n] = data[:n].reshape(-1, itemsize).T.reshape(-1)
+    result[n:] = data[n:]
+    return result
+
+
+def unshuffle(data, itemsize=SHUFFLE_ITEMSIZE):
+    data = np.frombuffer(data, np.uint8)
+    n = len(data) - len(data) % itemsize
+    result = np.empty_like(data)
+    result[:n] = data[:n].reshape(itemsize, -1).T.reshape(-1)
+    result[n:] = data[n:]
+    return result
+
+
+def __join(buffers):
+    if len(buffers) == 1:
+        return buffers[0]
+    return b''.join(buffers)
+
+
+def compress(codec, buffers):
+    """@compress
+
+    @:param codec: codec id or name.
+    @:param buffers list: bytes-like objects forming the payload.
+    :return: list of buffers with the encoded payload.
+    """
+    codec = getCodec(codec)
+    if codec.id == NONE:
+        return buffers
+    return [codec.compress(__join(buffers))]
+
+
+def decompress(codec, payload):
+    return getCodec(codec).decompress(payload)
+
+
+def selectCodec(size, tensors, transferMode='float32'):
+    """@selectCodec
+
+    @:param size int: payload size in bytes.
+    @:param tensors bool: payload is a tensor message body.
+    @:param transferMode str: transfer mode the tensors were encoded with.
+    :return: codec id.
+    """
+    if size < SMALL_PAYLOAD or tensors:
+        # weights barely compress (ratio about 1.17 for float32 with shuffle-zlib, 1.18 for int8) at tens of
+        # MB/s, slower than the links this runs on, and compressing joins the buffers sent straight from the
+        # tensors; use setCodec or the codec config key to compress them anyway
+        return NONE
+    return ZLIB_4
+
+
+register(NONE, 'none', lambda data: data, lambda data: data)
+register(ZLIB_1, 'zlib-1', lambda data: zlib.compress(data, 1), zlib.decompress)
+register(ZLIB_4, 'zlib-4', lambda data: zlib.compress(data, 4), zlib.decompress)
+register(ZLIB_9, 'zlib-9', lambda data: zlib.compress(data, 9), zlib.decompress)
+register(LZMA, 'lzma', lambda data: lzma.compress(data, preset=1), lzma.decompress)
+register(BZ2, 'bz2', lambda data: bz2.compress(data, 9), bz2.decompress)
+register(SHUFFLE_ZLIB, 'shuffle-zlib', lambda data: zlib.compress(shuffle(data), 4),
+         lambda data: unshuffle(zlib.decompress(data)))
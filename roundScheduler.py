@@ -0,0 +1,304 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import weightDelta
+from comunicationCodes import ComCodes
+
+
+class ClientStats:
+    """@ClientStats
+
+    Participation record of one client across scheduled rounds.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.offered = 0
+        self.onTime = 0
+        self.late = 0
+        self.dropped = 0
+        self.failed = 0
+        self.lastLatency = None
+        self.totalLatency = 0.0
+
+    def meanLatency(self):
+        replies = self.onTime + self.late
+        return self.totalLatency / replies if replies else None
+
+    def toDict(self):
+        return {'offered': self.offered, 'onTime': self.onTime, 'late': self.late, 'dropped': self.dropped,
+                'failed': self.failed, 'lastLatency': self.lastLatency, 'meanLatency': self.meanLatency()}
+
+
+class RoundReport:
+
+    def __init__(self, number, clients):
+        self.number = number
+        self.clients = clients
+        self.started = time.perf_counter()
+        self.duration = None
+        self.closeReason = None
+        self.onTime = []
+        self.late = []
+        self.missing = []
+        self.aggregated = False
+        self.error = None
+
+    def toDict(self):
+        return {'round': self.number, 'duration': self.duration, 'closeReason': self.closeReason,
+                'clients': self.clients, 'onTime': self.onTime, 'late': self.late, 'missing': self.missing,
+                'aggregated': self.aggregated, 'error': self.error}
+
+    def __str__(self):
+        text = ('Round ' + str(self.number) + ' closed by ' + str(self.closeReason) + ' after '
+                + str(round(self.duration or 0, 3)) + ' s: ' + str(len(self.onTime)) + ' on time, '
+                + str(len(self.late)) + ' late, ' + str(len(self.missing)) + ' missing')
+        if self.error is not None:
+            text += ', ' + self.error
+        return text
+
+
+class WeightDistributor:
+    """@WeightDistributor
+
+    Sends aggregated weights to clients as a delta against the version each of them acknowledged (see
+    weightDelta), full weights when it is unknown. Full weights are encoded and compressed once per transfer
+    mode and codec and the frame is shared by the clients receiving them.
+
+    @:param topK float: fraction of values sent per tensor, None for dense deltas.
+    """
+
+    def __init__(self, topK=None):
+        self.__topK = topK
+        self.__encoder = weightDelta.DeltaEncoder()
+        self.__mutex = threading.Lock()
+        # version of the weights each client is known to hold
+        self.__acknowledged = {}
+
+    def acknowledge(self, name, version):
+        """@acknowledge
+
+        @:param version: version client name holds, None when unknown; the next weights are then sent in full.
+        """
+        with self.__mutex:
+            if version is None:
+                self.__acknowledged.pop(name, None)
+            else:
+                self.__acknowledged[name] = version
+
+    def send(self, clients, version, weights):
+        """@send
+
+        :return: set of names of clients the weights were sent to.
+        """
+        frames = {}
+        received = set()
+        for client in clients:
+            name = client.getName()
+            mode = client.getTransferMode()
+            with self.__mutex:
+                base = self.__acknowledged.get(name)
+            tensors, info = self.__encoder.encode(name, weights, version, base, self.__topK, mode)
+            key = None
+            if info['encoding'] == 'full':
+                # peers holding the same version may have rebuilt different weights from it, so only full
+                # weights are the same for everyone
+                key = (mode, client.getCodec())
+            buffers = frames.get(key)
+            if buffers is None:
+                buffers = client.encode([ComCodes.POST_WEIGHTS, tensors, info])
+                if key is not None:
+                    frames[key] = buffers
+            try:
+                client.sendEncoded(buffers)
+                received.add(name)
+            except ConnectionError as e:
+                print('Weights not sent to', name + ':', e)
+        return received
+
+
+class RoundScheduler(threading.Thread):
+    """@RoundScheduler
+
+    Runs training rounds back to back. Each round asks idle clients to retrain and send their weights, and
+    closes at the deadline, when quorum updates arrived or when every client answered, whichever is first.
+    Whatever arrived is aggregated. Updates arriving after their round closed are folded into the current
+    round with their sample weight scaled by stalenessDecay ** staleness, or dropped beyond maxStaleness.
+    Clients still working on an earlier round are not offered a new one. Aggregated weights are sent to clients
+    through a WeightDistributor.
+
+    @:param federation FederationController: clients and aggregator.
+    @:param deadline float: round length limit in seconds.
+    @:param quorum int: number of updates that closes a round early, None to wait for every client.
+    @:param rounds int: number of rounds to run, None to run until stop.
+    @:param onAggregated: callable (weights) called on the scheduler thread with the aggregated weights of every
+        round, e.g. to apply them to the local model. When it returns a Future the next round starts once it is
+        done. Its errors are recorded in the RoundReport.
+    @:param topK float: fraction of values sent per tensor in weight updates to clients, None for dense deltas.
+    @:param onRoundFinished: callable (RoundReport) called on the scheduler thread.
+    """
+
+    def __init__(self, federation, deadline, quorum=None, rounds=None, stalenessDecay=0.5, maxStaleness=3,
+                 onAggregated=None, distribute=True, topK=None, onRoundFinished=None):
+        super().__init__(name='round-scheduler', daemon=True)
+        self.__federation = federation
+        self.__deadline = deadline
+        self.__quorum = quorum
+        self.__rounds = rounds
+        self.__stalenessDecay = stalenessDecay
+        self.__maxStaleness = maxStaleness
+        self.__onAggregated = onAggregated
+        self.__distribute = distribute
+        self.__onRoundFinished = onRoundFinished
+        self.__distributor = WeightDistributor(topK)
+
+        self.__condition = threading.Condition()
+        self.__running = True
+        # number of the round currently accepting updates
+        self.__round = 1
+        self.__report = None
+        self.__late = []
+        self.__busy = set()
+        self.__stats = {client.getName(): ClientStats(client.getName()) for client in federation.getClients()}
+        self.__reports = []
+
+    def stop(self):
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+
+    def getStats(self):
+        return self.__stats
+
+    def getReports(self):
+        return list(self.__reports)
+
+    def __startClient(self, client, number, holdsWeights):
+        name = client.getName()
+        sent = time.perf_counter()
+
+        def onWeights(future):
+            self.__finishClient(client, number, sent, future)
+
+        def onTrained(future):
+            if future.cancelled() or future.exception() is not None:
+                # whether the weights were applied is unknown
+                self.__distributor.acknowledge(name, None)
+                self.__finishClient(client, number, sent, future)
+                return
+            if holdsWeights:
+                self.__distributor.acknowledge(name, number)
+            client.request(ComCodes.GET_WEIGHTS, {'base': None, 'topK': None}).add_done_callback(onWeights)
+
+        args = []
+        aggregator = self.__federation.getAggregator()
+        if hasattr(aggregator, 'getTrainingArgs'):
+            args.append(aggregator.getTrainingArgs())
+        client.request(ComCodes.RETRAIN_MODEL, *args).add_done_callback(onTrained)
+
+    def __finishClient(self, client, number, sent, future):
+        name = client.getName()
+        stats = self.__stats[name]
+        latency = time.perf_counter() - sent
+        with self.__condition:
+            self.__busy.discard(name)
+            if future.cancelled() or future.exception() is not None:
+                stats.failed += 1
+                self.__condition.notify_all()
+                return
+
+            staleness = self.__round - number
+            if staleness > self.__maxStaleness:
+                stats.dropped += 1
+                self.__condition.notify_all()
+                return
+
+            stats.lastLatency = latency
+            stats.totalLatency += latency
+            if staleness == 0:
+                stats.onTime += 1
+                self.__report.onTime.append(name)
+            else:
+                stats.late += 1
+                self.__late.append(name)
+
+            message = future.result()
+            if staleness > 0:
+                info = dict(message[-1]) if isinstance(message[-1], dict) else {}
+                info['samples'] = info.get('samples', 1.0) * self.__stalenessDecay ** staleness
+                message = list(message[:2]) + [info]
+            try:
+                self.__federation.foldWeights(client, message)
+            except Exception as e:
+                print('Update from', name, 'rejected:', e)
+            self.__condition.notify_all()
+
+    def __runRound(self, weights):
+        with self.__condition:
+            number = self.__round
+            clients = [c for c in self.__federation.getClients() if c.getName() not in self.__busy]
+            self.__report = RoundReport(number, [c.getName() for c in clients])
+            report = self.__report
+            # late updates that arrived since the previous round closed belong to this aggregation
+            report.late.extend(self.__late)
+            self.__late = report.late
+            for client in clients:
+                self.__stats[client.getName()].offered += 1
+                self.__busy.add(client.getName())
+
+        # weights are encoded without holding the lock, reply callbacks on the connection thread wait for it
+        received = set() if weights is None else self.__distributor.send(clients, number, weights)
+        for client in clients:
+            self.__startClient(client, number, client.getName() in received)
+
+        with self.__condition:
+            closeAt = report.started + self.__deadline
+            while self.__running:
+                if clients and len(report.onTime) == len(clients):
+                    report.closeReason = 'all'
+                    break
+                if self.__quorum is not None and len(report.onTime) >= self.__quorum:
+                    report.closeReason = 'quorum'
+                    break
+                remaining = closeAt - time.perf_counter()
+                if remaining <= 0:
+                    report.closeReason = 'deadline'
+                    break
+                self.__condition.wait(remaining)
+            if not self.__running:
+                report.closeReason = 'stopped'
+            report.missing = [name for name in report.clients if name not in report.onTime]
+
+            # from now on updates for this round are late; they go to the next aggregation and report
+            self.__round += 1
+            self.__late = []
+            result = self.__federation.finishAggregation(reopen=True)
+
+        report.aggregated = result is not None
+        if result is not None and self.__onAggregated is not None:
+            try:
+                applied = self.__onAggregated(result)
+                if isinstance(applied, Future):
+                    applied.result()
+            except Exception as e:
+                print('Aggregated weights not applied:', e)
+                report.error = repr(e)
+        report.duration = time.perf_counter() - report.started
+        self.__reports.append(report)
+        return result
+
+    def run(self):
+        weights = None
+        # updates folded before the first round do not belong to any of them
+        self.__federation.beginAggregation()
+        while self.__running and (self.__rounds is None or len(self.__reports) < self.__rounds):
+            result = self.__runRound(weights if self.__distribute else None)
+            if result is not None:
+                weights = result
+            report = self.__reports[-1]
+            print(report)
+            if self.__onRoundFinished is not None:
+                self.__onRoundFinished(report)
+        # late updates of the last round have no round left to join
+        self.__federation.finishAggregation()
@@ -0,0 +1,222 @@
+import json
+import struct
+
+import numpy as np
+
+# Tensor message body:
+#
+#     [u32 manifest length][manifest JSON][padding][tensor 0][padding][tensor 1]...
+#
+# The manifest holds the message arguments, with every list of tensors replaced by
+# {"__tensors__": [first, count]}, and dtype, shape, layer name, offset and size of every tensor.
+# Tensor offsets are relative to the first tensor and aligned to ALIGNMENT bytes. Quantized tensors
+# carry a "quantization" entry with the original dtype and, for int8, scale and zero point.
+
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+TRANSFER_MODES = ('float32', 'float16', 'int8')
+
+__LENGTH = struct.Struct('!I')
+__PADDING = bytes(ALIGNMENT)
+
+
+def isTensorList(obj):
+    """@isTensorList
+
+    @:param obj: any message argument.
+    :return: True if obj is a non empty list of numpy arrays or tensor variables.
+    """
+    if not isinstance(obj, (list, tuple)) or len(obj) == 0:
+        return False
+    for item in obj:
+        if not (hasattr(item, 'shape') and hasattr(item, 'dtype')):
+            return False
+    return True
+
+
+class QuantizedTensor:
+    """@QuantizedTensor
+
+    Tensor received in a quantized transfer mode. Values stay in their wire dtype until dequantize is called.
+    """
+
+    def __init__(self, values, dtype, scale=1.0, zeroPoint=0):
+        self.values = values
+        self.dtype = np.dtype(dtype)
+        self.shape = values.shape
+        self.scale = scale
+        self.zeroPoint = zeroPoint
+
+    def dequantize(self):
+        if self.values.dtype == np.int8:
+            result = self.values.astype(self.dtype)
+            result -= self.zeroPoint
+            result *= self.scale
+            return result
+        return self.values.astype(self.dtype)
+
+
+def quantize(array, mode):
+    """@quantize
+
+    @:param array np.array: tensor to quantize. Only floating point tensors are quantized.
+    @:param mode str: one of TRANSFER_MODES.
+    :return: np.array (unchanged) or QuantizedTensor.
+    """
+    if mode not in TRANSFER_MODES:
+        raise ValueError('Unknown transfer mode ' + str(mode) + ', expected one of ' + str(TRANSFER_MODES))
+    array = np.asarray(array)
+    if mode == 'float32' or not np.issubdtype(array.dtype, np.floating) or array.size == 0:
+        return array
+    if mode == 'float16':
+        return QuantizedTensor(array.astype(np.float16), array.dtype)
+
+    # per-tensor affine int8: x ~ (q - zeroPoint) * scale
+    low = min(float(array.min()), 0.0)
+    high = max(float(array.max()), 0.0)
+    scale = (high - low) / 255.0 or 1.0
+    zeroPoint = int(round(-128 - low / scale))
+    values = np.rint(array / scale)
+    values += zeroPoint
+    np.clip(values, -128, 127, out=values)
+    return QuantizedTensor(values.astype(np.int8), array.dtype, scale, zeroPoint)
+
+
+def dequantize(tensor):
+    """@dequantize
+
+    @:param tensor: np.array, QuantizedTensor, tensor variable or nested list.
+    :return: np.array in the original dtype. Plain numpy arrays are returned without copying.
+    """
+    if isinstance(tensor, QuantizedTensor):
+        return tensor.dequantize()
+    if isinstance(tensor, np.ndarray):
+        return tensor
+    if hasattr(tensor, 'numpy'):
+        return tensor.numpy()
+    return np.asarray(tensor)
+
+
+def roundTrip(arrays, mode):
+    """@roundTrip
+
+    :return: arrays as the receiving side sees them after a transfer in given mode.
+    """
+    return [dequantize(quantize(array, mode)) for array in arrays]
+
+
+def hasTensors(args):
+    for arg in args:
+        if isTensorList(arg):
+            return True
+    return False
+
+
+def __tensorName(tensor):
+    name = getattr(tensor, 'name', None)
+    return name if isinstance(name, str) else ''
+
+
+def __jsonDefault(obj):
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError('Object of type ' + type(obj).__name__ + ' cannot be sent in a tensor message')
+
+
+def __padding(offset):
+    return (-offset) % ALIGNMENT
+
+
+def encode(args, transferMode='float32'):
+    """@encode
+
+    Builds the message body without copying tensor data; numpy buffers are referenced directly.
+    In float16 and int8 transfer modes floating point tensors are quantized first.
+
+    @:param args list: message arguments (everything after the ComCode).
+    @:param transferMode str: one of TRANSFER_MODES.
+    :return: tuple (list of buffers, total length in bytes).
+    """
+    manifestArgs = []
+    tensors = []
+    arrays = []
+    for arg in args:
+        if isTensorList(arg):
+            manifestArgs.append({'__tensors__': [len(arrays), len(arg)]})
+            for tensor in arg:
+                entry = {'name': __tensorName(tensor)}
+                if not isinstance(tensor, QuantizedTensor):
+                    tensor = quantize(tensor, transferMode)
+                if isinstance(tensor, QuantizedTensor):
+                    entry['quantization'] = {'dtype': tensor.dtype.str,
+                                             'scale': tensor.scale,
+                                             'zeroPoint': tensor.zeroPoint}
+                    tensor = tensor.values
+                array = np.ascontiguousarray(tensor)
+                arrays.append(array)
+                entry.update({'dtype': array.dtype.str,
+                              'shape': list(array.shape),
+                              'nbytes': array.nbytes})
+                tensors.append(entry)
+        else:
+            manifestArgs.append(arg)
+
+    # offsets are relative to the data start, so they do not depend on the manifest length
+    offset = 0
+    for tensor in tensors:
+        offset += __padding(offset)
+        tensor['offset'] = offset
+        offset += tensor['nbytes']
+
+    manifest = json.dumps({'version': FORMAT_VERSION, 'args': manifestArgs, 'tensors': tensors},
+                          default=__jsonDefault).encode('utf-8')
+    prefixLength = __LENGTH.size + len(manifest)
+    dataStart = prefixLength + __padding(prefixLength)
+
+    buffers = [__LENGTH.pack(len(manifest)) + manifest + __PADDING[:dataStart - prefixLength]]
+    position = 0
+    for tensor, array in zip(tensors, arrays):
+        gap = tensor['offset'] - position
+        if gap:
+            buffers.append(__PADDING[:gap])
+        if array.nbytes:
+            buffers.append(memoryview(array.reshape(-1)).cast('B'))
+        position = tensor['offset'] + tensor['nbytes']
+    return buffers, dataStart + position
+
+
+def decode(payload):
+    """@decode
+
+    @:param payload bytearray: message body produced by encode.
+    :return: list of message arguments; tensor lists are numpy views into payload, quantized tensors are
+        QuantizedTensor objects wrapping such views.
+    """
+    (manifestLength,) = __LENGTH.unpack_from(payload, 0)
+    prefixLength = __LENGTH.size + manifestLength
+    manifest = json.loads(bytes(payload[__LENGTH.size:prefixLength]).decode('utf-8'))
+    if manifest['version'] != FORMAT_VERSION:
+        raise ValueError('Unsupported tensor format version ' + str(manifest['version']))
+    dataStart = prefixLength + __padding(prefixLength)
+
+    arrays = []
+    for tensor in manifest['tensors']:
+        dtype = np.dtype(tensor['dtype'])
+        count = tensor['nbytes'] // dtype.itemsize
+        array = np.frombuffer(payload, dtype=dtype, count=count, offset=dataStart + tensor['offset'])
+        array = array.reshape(tensor['shape'])
+        if 'quantization' in tensor:
+            quantization = tensor['quantization']
+            array = QuantizedTensor(array, quantization['dtype'], quantization['scale'], quantization['zeroPoint'])
+        arrays.append(array)
+
+    args = []
+    for arg in manifest['args']:
+        if isinstance(arg, dict) and '__tensors__' in arg:
+            first, count = arg['__tensors__']
+            args.append(arrays[first:first + count])
+        else:
+            args.append(arg)
+    return args
+
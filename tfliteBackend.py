@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+QUANTIZATIONS = ('dynamic', 'float16', None)
+
+
+class TFLiteBackend:
+    """@TFLiteBackend
+
+    Serves inference of a keras model from a TFLite interpreter on the CPU.
+
+    @:param quantization str: 'dynamic' for dynamic range (int8 weights), 'float16' for float16 weights,
+        None for a plain float32 conversion.
+    @:param threads int: interpreter threads, None for the TFLite default.
+    """
+
+    def __init__(self, quantization='dynamic', threads=None):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError('Unknown quantization ' + str(quantization) + ', expected one of ' + str(QUANTIZATIONS))
+        self.__quantization = quantization
+        self.__threads = threads
+        self.__mutex = threading.Lock()
+        self.__flatbuffer = None
+        self.__interpreter = None
+        self.__batch = None
+
+    def getQuantization(self):
+        return self.__quantization
+
+    def getThreads(self):
+        return self.__threads
+
+    def getModelSize(self):
+        """@getModelSize
+
+        :return: size of the converted model in bytes, None before convert.
+        """
+        return None if self.__flatbuffer is None else len(self.__flatbuffer)
+
+    def convert(self, model):
+        """@convert
+
+        Converts model with its current weights and replaces the interpreter.
+        """
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if self.__quantization is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if self.__quantization == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        flatbuffer = converter.convert()
+
+        interpreter = tf.lite.Interpreter(model_content=flatbuffer, num_threads=self.__threads)
+        interpreter.allocate_tensors()
+        with self.__mutex:
+            self.__flatbuffer = flatbuffer
+            self.__interpreter = interpreter
+            self.__batch = int(interpreter.get_input_details()[0]['shape'][0])
+
+    def infer(self, images):
+        """@infer
+
+        @:param images np.array: (n, height, width, 3) batch.
+        :return: (n, classes) np.array of model outputs.
+        """
+        images = np.ascontiguousarray(images, dtype=np.float32)
+        with self.__mutex:
+            if self.__interpreter is None:
+                raise RuntimeError('Model was not converted')
+            inputIndex = self.__interpreter.get_input_details()[0]['index']
+            if len(images) != self.__batch:
+                self.__interpreter.resize_tensor_input(inputIndex, images.shape)
+                self.__interpreter.allocate_tensors()
+                self.__batch = len(images)
+            self.__interpreter.set_tensor(inputIndex, images)
+            self.__interpreter.invoke()
+            return self.__interpreter.get_tensor(self.__interpreter.get_output_details()[0]['index'])
@@ -0,0 +1,80 @@
+import threading
+from collections import namedtuple
+
+# event kinds; target names the client for per client events, value is the new state
+CLIENT_ACCURACY = 'clientAccuracy'
+CLIENT_STATUS = 'clientStatus'
+SERVER_ACCURACY = 'serverAccuracy'
+CONTROLS_ENABLED = 'controlsEnabled'
+MODEL_TYPE = 'modelType'
+MODEL_ACCURACY = 'modelAccuracy'
+PREDICT_ENABLED = 'predictEnabled'
+
+UiEvent = namedtuple('UiEvent', ['kind', 'target', 'value'])
+
+
+class UiEventBus:
+    """@UiEventBus
+
+    Hands status changes from connection and worker threads to the GUI thread. Any thread posts events;
+    the GUI thread calls dispatch periodically (from a timer), so widgets are redrawn at a bounded rate.
+    Events are coalesced per (kind, target): only the latest value posted between two dispatches is kept.
+    The bus itself has no Qt dependency.
+    """
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.__pending = {}
+        self.__handlers = {}
+        self.__posted = 0
+        self.__coalesced = 0
+
+    def setHandler(self, kind, handler):
+        """@setHandler
+
+        @:param handler: callable (target, value) run by dispatch for events of kind.
+        """
+        self.__handlers[kind] = handler
+
+    def post(self, kind, target=None, value=None):
+        with self.__mutex:
+            key = (kind, target)
+            if key in self.__pending:
+                self.__coalesced += 1
+            self.__pending[key] = UiEvent(kind, target, value)
+            self.__posted += 1
+
+    def drain(self):
+        """@drain
+
+        :return: list of pending events in order of their first post; the bus is emptied.
+        """
+        with self.__mutex:
+            events = list(self.__pending.values())
+            self.__pending = {}
+        return events
+
+    def dispatch(self):
+        """@dispatch
+
+        Drains the bus and runs the handler of every event. Call it on the GUI thread.
+        :return: number of events handled.
+        """
+        events = self.drain()
+        for event in events:
+            handler = self.__handlers.get(event.kind)
+            if handler is None:
+                continue
+            try:
+                handler(event.target, event.value)
+            except Exception as e:
+                print('UI event', event.kind, 'failed:', e)
+        return len(events)
+
+    def getStats(self):
+        """@getStats
+
+        :return: (events posted, events replaced by a later post before dispatch).
+        """
+        with self.__mutex:
+            return self.__posted, self.__coalesced
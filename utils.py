@@ -14,6 +14,48 @@ def getServerPort(path='..\\config.txt'):
     return int(__readProperty('serverPort', path))
 
 
+def getTransferMode(path='..\\config.txt'):
+    mode = __readProperty('transferMode', path)
+    if mode is None:
+        return 'float32'
+    return mode
+
+
+def getUpdateTopK(path='..\\config.txt'):
+    topK = __readProperty('updateTopK', path)
+    if topK is None:
+        return None
+    return float(topK)
+
+
+def getCodec(path='..\\config.txt'):
+    codec = __readProperty('codec', path)
+    if codec is None or codec == 'auto':
+        return None
+    return codec
+
+
+def getRoundTimeout(path='..\\config.txt'):
+    timeout = __readProperty('roundTimeout', path)
+    if timeout is None:
+        return 600.0
+    return float(timeout)
+
+
+def getRoundQuorum(path='..\\config.txt'):
+    quorum = __readProperty('roundQuorum', path)
+    if quorum is None:
+        return None
+    return int(quorum)
+
+
+def getModelCacheBudget(path='..\\config.txt'):
+    budget = __readProperty('modelCacheMB', path)
+    if budget is None:
+        return 2 * 1024 ** 3
+    return int(float(budget) * 1024 ** 2)
+
+
 def __readProperty(prop, path='..\\config.txt'):
     with open(path, 'r') as config:
         lines = config.readlines()
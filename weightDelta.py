@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+
+import tensorFormat
+
+# Update info sent next to the tensors of a weight message:
+#   version   - version of the weights the receiver ends up with
+#   base      - version the update applies to, None for a full weight set
+#   encoding  - 'full', 'delta' (dense differences) or 'sparse' (index/value pairs per tensor)
+#   shapes    - tensor shapes, needed to rebuild sparse updates
+
+
+class _PeerState:
+
+    def __init__(self):
+        self.acknowledged = None
+        self.pending = None
+
+    def acknowledge(self, version):
+        """@acknowledge
+
+        :return: weights the peer holds in given version or None if they are no longer known.
+        """
+        if self.pending is not None and self.pending[0] == version:
+            self.acknowledged = self.pending
+            self.pending = None
+        if self.acknowledged is not None and self.acknowledged[0] == version:
+            return self.acknowledged[1]
+        return None
+
+
+class DeltaEncoder:
+    """@DeltaEncoder
+
+    Sender side of delta updates. For every peer it keeps the weights the peer reconstructed from the last
+    update it acknowledged, so an update only carries the difference. With topK only the largest
+    differences are sent; what was left out stays in the difference to the peer's weights and is sent in a
+    later update (error feedback).
+    """
+
+    def __init__(self):
+        self.__peers = {}
+
+    def forget(self, peer=None):
+        if peer is None:
+            self.__peers.clear()
+        else:
+            self.__peers.pop(peer, None)
+
+    def encode(self, peer, weights, version, baseVersion=None, topK=None, transferMode='float32'):
+        """@encode
+
+        @:param peer: any hashable peer identifier.
+        @:param weights list: current weights.
+        @:param version int: version of current weights.
+        @:param baseVersion int: version the peer holds, None to request full weights.
+        @:param topK float: fraction (0, 1] of values sent per tensor, None for a dense delta.
+        @:param transferMode str: transfer mode of the connection, so quantization error is fed back as well.
+        :return: tuple (list of tensors, update info dict).
+        """
+        weights = [np.asarray(w) for w in weights]
+        state = self.__peers.setdefault(peer, _PeerState())
+        base = None if baseVersion is None else state.acknowledge(baseVersion)
+        info = {'version': version, 'shapes': [list(w.shape) for w in weights]}
+
+        if base is None or [b.shape for b in base] != [w.shape for w in weights]:
+            state.acknowledged = None
+            state.pending = (version, [np.array(w) for w in tensorFormat.roundTrip(weights, transferMode)])
+            info.update({'base': None, 'encoding': 'full'})
+            return weights, info
+
+        info['base'] = baseVersion
+        if topK is None:
+            tensors = [w - b for w, b in zip(weights, base)]
+            sent = tensorFormat.roundTrip(tensors, transferMode)
+            state.pending = (version, [b + d for b, d in zip(base, sent)])
+            info['encoding'] = 'delta'
+            return tensors, info
+
+        tensors = []
+        reconstructed = []
+        for w, b in zip(weights, base):
+            delta = (w - b).reshape(-1)
+            k = min(delta.size, max(1, int(math.ceil(topK * delta.size))))
+            if k < delta.size:
+                indices = np.argpartition(np.abs(delta), delta.size - k)[delta.size - k:]
+                indices.sort()
+            else:
+                indices = np.arange(delta.size)
+            values = delta[indices]
+            peerWeights = b.copy()
+            peerWeights.reshape(-1)[indices] += tensorFormat.roundTrip([values], transferMode)[0]
+            tensors.append(indices.astype(np.uint32))
+            tensors.append(values)
+            reconstructed.append(peerWeights)
+        state.pending = (version, reconstructed)
+        info['encoding'] = 'sparse'
+        return tensors, info
+
+
+def applyUpdate(base, tensors, info):
+    """@applyUpdate
+
+    @:param base list: weights the update was computed against, ignored for full updates.
+    @:param tensors list: tensors received with the update (possibly quantized).
+    @:param info dict: update info, None for a plain weight list.
+    :return: list of new weights as numpy arrays.
+    """
+    encoding = 'full' if info is None else info.get('encoding', 'full')
+    if encoding == 'full':
+        return [tensorFormat.dequantize(t) for t in tensors]
+
+    shapes = [tuple(shape) for shape in info['shapes']]
+    base = [np.asarray(b) for b in base]
+    if [b.shape for b in base] != shapes:
+        raise ValueError('Update shapes ' + str(shapes) + ' do not match base weights')
+
+    if encoding == 'delta':
+        return [b + tensorFormat.dequantize(d) for b, d in zip(base, tensors)]
+    if encoding == 'sparse':
+        result = []
+        for i, b in enumerate(base):
+            indices = np.asarray(tensors[2 * i])
+            values = tensorFormat.dequantize(tensors[2 * i + 1])
+            weights = b.copy()
+            weights.reshape(-1)[indices] += values
+            result.append(weights)
+        return result
+    raise ValueError('Unknown update encoding ' + str(encoding))